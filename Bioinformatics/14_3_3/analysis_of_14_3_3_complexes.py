@@ -2,8 +2,14 @@
 # Should be executed in pymol command line
 # Frederik Friis Theisen 2024, University of Copenhagen
 
-import re
 import statistics
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import structure_store # Structures are read from the local store instead of cmd.fetch
+import peptide_index
+import metadata_index # Isoforms and substances are looked up instead of parsed from the CIF text
 
 # Mapping of amino acid codes to single-letter codes
 ONE_LETTER_STANDARD = {
@@ -79,7 +85,7 @@ def align_structured(groups, parentgroup = ""):
             resi = group['PHOSRESI'][i]
             contains_smallmol = group['SMALLMOL'][i] != ""
             print(pdb_id)
-            cmd.fetch(pdb_id)
+            structure_store.load(cmd, pdb_id)
             cmd.do('remove solvent')
             cmd.select('PROBE', f'{pdb_id} and chain {chain} and resi {resi}')
             cmd.do('select PROBE, PROBE extend 7')
@@ -130,35 +136,48 @@ def align_structured(groups, parentgroup = ""):
 
     cmd.center()
 
+def peptide_group_sequence(peptide):
+    pepseq = peptide['SEQUENCE_PEPTIDE_RAW']
+
+    if GROUP_BY_MOTIF:
+        start = clamp(peptide['PHOSRESI_LOCAL'] - PHOS_BUFFER[0], 0, len(pepseq))
+        end =   clamp(peptide['PHOSRESI_LOCAL'] + PHOS_BUFFER[1] + 1, 0, len(pepseq))
+        pepseq = pepseq[start:end]
+    return pepseq
+
 def group_by_peptide(peptides):
+    # A peptide joins the oldest group whose sequence contains it or is contained in it. A group sequence contained
+    # in the peptide is replaced by the peptide sequence and the group moves to the end.
+    # Containment of all sequences is looked up in one index instead of testing every group
     output = {}
-    
-    for peptide in peptides:
-        logged = False
-        pepseq = peptide['SEQUENCE_PEPTIDE_RAW']
-
-        if GROUP_BY_MOTIF:
-            start = clamp(peptide['PHOSRESI_LOCAL'] - PHOS_BUFFER[0], 0, len(pepseq))
-            end =   clamp(peptide['PHOSRESI_LOCAL'] + PHOS_BUFFER[1] + 1, 0, len(pepseq))
-            pepseq = pepseq[start:end]
-
-        for seq, details in output.items():
-            if pepseq in seq:
-                for key, value in peptide.items():
-                    details[key].append(value)
-                logged = True
-                break
-            elif seq in pepseq:
-                new_details = output.pop(seq)
-                for key, value in peptide.items():
-                    new_details[key].append(value)
-                output[pepseq] = new_details
-                logged = True
-                break
-        
-        if not logged:
+    order = {} # Insertion position of each group sequence, the order of output
+    position = 0
+    sequences = [peptide_group_sequence(peptide) for peptide in peptides]
+    index = peptide_index.ContainmentIndex(sequences)
+
+    for peptide, pepseq in zip(peptides, sequences):
+        related = [seq for seq in index.containers(pepseq) | index.contained(pepseq) if seq in order]
+
+        if len(related) == 0:
             output[pepseq] = {key: [value] for key, value in peptide.items()}
-    
+            order[pepseq] = position
+            position += 1
+            continue
+
+        seq = min(related, key=lambda seq: order[seq])
+        if pepseq in seq:
+            details = output[seq]
+        else:
+            details = output.pop(seq)
+            order.pop(seq)
+            if pepseq not in order: # An existing group of the same sequence is replaced in place
+                order[pepseq] = position
+                position += 1
+            output[pepseq] = details
+
+        for key, value in peptide.items():
+            details[key].append(value)
+
     return output
 
 def process_pdb_id(pdb_id, chains_and_phosres):
@@ -273,39 +292,30 @@ def get_isoform_and_substance_info_from_cif(pdb_id):
     small_mol_name = ""
     small_mol_mw = 0
 
-    with open(pdb_id + ".cif") as f:
-        lines = f.readlines()
-        for line in lines:
-            if "14-3-3" in line:
-                for form in ISOFORMS:
-                    if form in line:
-                        if form not in isoform:
-                            isoform += form + ','
-                if isoform != "": break
-        
-        if isoform == "":
-            isoform = "unknown"
-        else: isoform = isoform[:-1]
-
-        # Detect substances
-        _detectsm = False
-        for line in lines:
-            if "_entity.details" in line: _detectsm = True
-            elif _detectsm and line[0] == '#': break
-            elif _detectsm:
-                molecule = re.findall("(?:\'.*?\'|\S)+", line)
-                if len(molecule) < 5: continue
-                if molecule[1] == 'non-polymer' and molecule[2] == 'syn':
-
-                    try:
-                        molname = molecule[3].strip('\'')
-                        mw_sm = float(molecule[4])
-                        if mw_sm < 90 or mw_sm in SmallMoleculeMassIgnoreList or molname in SmallMoleculeMassIgnoreList: continue # Substance not banned
-                        elif mw_sm > small_mol_mw: # Return the largest small molecule found
-                            small_mol_name = molname
-                            small_mol_mw = mw_sm
-                    except:
-                        print(molecule)
+    # Lines mentioning 14-3-3 and the entities of the entry from the metadata index
+    for line in metadata_index.mentions(pdb_id):
+        for form in ISOFORMS:
+            if form in line:
+                if form not in isoform:
+                    isoform += form + ','
+        if isoform != "": break
+
+    if isoform == "":
+        isoform = "unknown"
+    else: isoform = isoform[:-1]
+
+    # Detect substances
+    for molecule in metadata_index.entities(pdb_id):
+        if molecule['type'] == 'non-polymer' and molecule['src_method'] == 'syn':
+            try:
+                molname = molecule['description']
+                mw_sm = float(molecule['formula_weight'])
+                if mw_sm < 90 or mw_sm in SmallMoleculeMassIgnoreList or molname in SmallMoleculeMassIgnoreList: continue # Substance not banned
+                elif mw_sm > small_mol_mw: # Return the largest small molecule found
+                    small_mol_name = molname
+                    small_mol_mw = mw_sm
+            except:
+                print(molecule)
 
     return isoform, small_mol_name
 
@@ -321,12 +331,16 @@ def main():
         filedata = f.readlines()[0]
         pdb_ids = filedata.split(',')
 
+    # Fill the local structure store once, reruns read all entries locally
+    structure_store.prefetch([pdb_id for pdb_id in pdb_ids if pdb_id not in SKIP_IDS])
+    metadata_index.update([pdb_id for pdb_id in pdb_ids if pdb_id not in SKIP_IDS])
+
     for pdb_id in pdb_ids:
         if pdb_id in SKIP_IDS:
             continue
         # Fetch and process data for each pdb_id
         cmd.reinitialize()
-        cmd.fetch(pdb_id)
+        structure_store.load(cmd, pdb_id)
         cmd.do('remove solvent')
         # Select all phosphorylated residues of correct types
         cmd.select('PHOS','present and (resn SEP or resn TPO)')
@@ -366,6 +380,7 @@ def main():
     print(f"    UNIQUE PEPTIDES:            {len(trans_groups)}")
     print()
     if GROUP_BY_MOTIF: print(f"PEPTIDE GROUPING RANGE: PHOSRES -{PHOS_BUFFER[0]} to +{PHOS_BUFFER[1]}")
+    print(structure_store.format_stats())
 
     with open('./incomp_complexes.txt','w') as f:
         for pep in incompatiblecomplexes:
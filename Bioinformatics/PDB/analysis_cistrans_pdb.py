@@ -1,7 +1,31 @@
-import shlex
 import json
 import re
-import pymol2
+import os
+import sys
+from multiprocessing import Pool
+import numpy as np
+import omega_engine
+import omega_statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import structure_store
+import metadata_index
+
+try:
+    import pymol2
+except ImportError:
+    pymol2 = None # Only needed for ENGINE = 'pymol'
+
+DATABASE_LIST = '../pdb_lists/231129_sub30res_peptides.txt'
+DATABASE_OUT = '../database.json'
+JOURNAL_OUT = '../database_journal.jsonl' # One line per finished or failed entry, a restarted scan skips finished entries
+ANGLES_OUT = '../pdb_angles.txt'
+STATISTICS_OUT = '../pdb_omega' # Prefix of the summary tables, see omega_statistics.export_tables
+GEOMETRY_OUT = '../pdb_geometry.npz' # Geometry of all residues of all chains, see export_geometry
+WORKERS = os.cpu_count() # Number of worker processes, 1 scans in this process
+MAX_IDS = None # Only scan the first MAX_IDS entries of the list (testing)
+CHUNKSIZE = 4 # Entries handed to a worker at a time
+ENGINE = 'numpy' # Structures are read from structure_store, 'numpy' measures them with omega_engine, 'pymol' in a PyMOL session
 
 aa_codes ={'VAL':'V', 'ILE':'I', 'LEU':'L', 'GLU':'E', 'GLN':'Q','ASP':'D', 'ASN':'N', 'HIS':'H', 'TRP':'W', 'PHE':'F', 'TYR':'Y','ARG':'R', 'LYS':'K', 'SER':'S', 'THR':'T', 'MET':'M', 'ALA':'A','GLY':'G', 'PRO':'P', 'CYS':'C', 'SEP':'[SEP]','TPO':'[TPO]', 'LPD':'P', 'DVA':'V', 'DAL':'A', 'B3L':'L', 'B3A':'A', 'UXQ':'X', 'ALY':'K'}
 one_letter ={'VAL':'V', 'ILE':'I', 'LEU':'L', 'GLU':'E', 'GLN':'Q','ASP':'D', 'ASN':'N', 'HIS':'H', 'TRP':'W', 'PHE':'F', 'TYR':'Y','ARG':'R', 'LYS':'K', 'SER':'S', 'THR':'T', 'MET':'M', 'ALA':'A','GLY':'G', 'PRO':'P', 'CYS':'C', 'SEP':'S','TPO':'T', 'LPD':'P', 'DVA':'V', 'DAL':'A', 'B3L':'L', 'B3A':'A', 'UXQ':'X', 'ALY':'K'}
@@ -12,13 +36,11 @@ def read_database(path):
     with open(path) as f:
         for line in f:
             ids.extend(line.split(','))
-    return [id.lower() for id in ids]
+    return [id.strip().lower() for id in ids if id.strip() != '']
 
-def get_database(database, pymol):
-    for id in database:
-        pymol.cmd.reinitialize()
-        pymol.cmd.fetch(id)
-    pymol.cmd.reinitialize()
+def get_database(database, pymol=None):
+    # Fill the local structure store, returns the ids that are not available
+    return structure_store.prefetch(database)
 
 def clean_resi(resi):
     idx = re.sub(r"\D", "", resi)
@@ -34,209 +56,58 @@ def parse_cif_for_chain_info(pdb_code):
     or the shortest chain if none are under 20 residues. Returns PDB ID, chain ID, protein name, and length.
 
     Args:
-    file_path (str): Path to the CIF file.
+    pdb_code (str): PDB ID, looked up in the metadata index of the structure store.
 
     Returns:
-    tuple: (PDB ID, chain ID, protein name, chain length)
+    list: [{'pdb', 'chain', 'name', 'length', 'accession_code'}, ...]
     """
-    file_path = './' + pdb_code + '.cif'
-
-    # Storing chain information and protein names
-    chain_info = {}
-    protein_names = {}
-    accession_code = {}
-
-    with open(file_path, 'r') as file:
-        #lines = file.readlines()
-        current_loop = None
-        multiline = False
-        headers = []
-        loop_id = None
-        length = {}
-
-        for line in file:
-            # Identify the beginning of a loop
-            if line.startswith('loop_'):
-                current_loop = 'loop'
-                headers = []
-                continue
+    # Chain information and protein names from the metadata index
+    chain_info = {row['chain']: row for row in metadata_index.chains(pdb_code)}
+    accession_code = {row['ref_id']: row['accession'] for row in metadata_index.refs(pdb_code) if row['accession'] is not None}
+    protein_names = {row['id']: row['description'] for row in metadata_index.entities(pdb_code) if row['description'] is not None}
 
-            # Identify the end of a loop
-            if line.startswith('#'):
-                current_loop = None
-                continue
+    # Cross-referencing to get full chain details
+    chains_under_20 = []
+    shortest_chain = None
+    shortest_length = float('inf')
 
-            # Process headers in the loop
-            if current_loop and line.startswith('_'):
-                headers.append(line.strip())
-                loop_id = line.split('.')[0]
-                continue
+    for chain_id, info in chain_info.items():
+        ref_id = info['ref_id']
+        length = info['length']
+        name = protein_names.get(ref_id, 'Unknown')
+        acc = accession_code.get(ref_id, 'Unknown')
 
-            # Process values in the loop
-            if current_loop and line.strip() and not line.startswith('_') and not line.startswith(';'):
-                if loop_id in ['_struct_ref_seq','_struct_ref','_entity']: # Speed optimization
-                    values = []
-                    values.extend(shlex.split(line))
-
-                    if len(values) < len(headers):
-                        while len(values) < len(headers):
-                            print(len(headers),len(values),values)
-                            value = ""
-                            for continued_line in file:
-                                print(loop_id,continued_line.strip())
-                                if len(value) == 0 and ';' not in continued_line:
-                                    values.extend(shlex.split(continued_line.strip()))
-                                    print("END MULTILINE 2",continued_line.strip())
-                                    break
-                                if len(value) > 0 and ';' in continued_line or '#' in continued_line:
-                                    print("END MULTILINE 1",value)
-                                    values.append(value)
-                                    break
-                                else:
-                                    value += continued_line.strip(';').strip()
-
-                    if '_struct_ref_seq.pdbx_strand_id' in headers:
-                        chain_id_index = headers.index('_struct_ref_seq.pdbx_strand_id')
-                        beg_index = headers.index('_struct_ref_seq.pdbx_auth_seq_align_beg')
-                        end_index = headers.index('_struct_ref_seq.pdbx_auth_seq_align_end')
-                        ref_id_index = headers.index('_struct_ref_seq.ref_id')
-                        ref_id = values[ref_id_index]
-                        chain_id = values[chain_id_index]
-
-                        if chain_id not in length: length[chain_id] = 0
-                        beg = clean_resi(values[beg_index])
-                        end = clean_resi(values[end_index])
-                        if beg != None and end != None: length[chain_id] += (end - beg + 1)
-
-                        chain_info[chain_id] = {'ref_id': ref_id, 'length': length[chain_id]}
-
-                    elif '_struct_ref.pdbx_db_accession' in headers:
-                        ref_id_index = headers.index('_struct_ref.id')
-                        acc_index = headers.index('_struct_ref.pdbx_db_accession')
-                        if len(values) <= acc_index: continue
-                        ref_id = values[ref_id_index]
-                        acc = values[acc_index]
-                        accession_code[ref_id] = acc
-
-                    elif '_entity.pdbx_description' in headers:
-                        ref_id_index = headers.index('_entity.id')
-                        name_index = headers.index('_entity.pdbx_description')
-                        if len(values) <= name_index: continue
-                        ref_id = values[ref_id_index]
-                        name = values[name_index]
-                        protein_names[ref_id] = name
-
-
-        # Cross-referencing to get full chain details
-        chains_under_20 = []
-        shortest_chain = None
-        shortest_length = float('inf')
-
-        for chain_id, info in chain_info.items():
-            ref_id = info['ref_id']
-            length = info['length']
-            name = protein_names.get(ref_id, 'Unknown')
-            acc = accession_code.get(ref_id, 'Unknown')
-
-            entry = {'pdb':pdb_code,'chain':chain_id, 'name':name, 'length':length, 'accession_code':acc}
-
-            if length <= 30:
-                chains_under_20.append(entry)
-
-            if length < shortest_length:
-                shortest_chain = entry
-                shortest_length = length
-
-        # Decide what to return based on the findings
-        if chains_under_20:
-            return chains_under_20
-        else:
-            return [shortest_chain]
+        entry = {'pdb':pdb_code,'chain':chain_id, 'name':name, 'length':length, 'accession_code':acc}
 
-def parse_cif_for_uniprot_info(pdb_code):
-    file_path = './' + pdb_code + '.cif'
+        if length <= 30:
+            chains_under_20.append(entry)
 
-    # Storing chain information and protein names
-    chain_info = {}
-    protein_names = {}
-    accession_info = {}
+        if length < shortest_length:
+            shortest_chain = entry
+            shortest_length = length
 
-    with open(file_path, 'r') as file:
-        #lines = file.readlines()
-        current_loop = None
-        multiline = False
-        headers = []
-        uniprot_id = None
-
-        for line in file:
-            # Identify the beginning of a loop
-            if line.startswith('loop_'):
-                current_loop = 'loop'
-                headers = []
-                continue
+    # Decide what to return based on the findings
+    if chains_under_20:
+        return chains_under_20
+    else:
+        return [shortest_chain]
 
-            # Identify the end of a loop
-            if line.startswith('#'):
-                current_loop = None
-                continue
+def parse_cif_for_uniprot_info(pdb_code):
+    # Database references of each chain, {chain: [{'db', 'code', 'accession'}, ...]}
+    accession_info = {}
+    for row in metadata_index.refs(pdb_code):
+        if row['ref_id'] not in accession_info: accession_info[row['ref_id']] = []
+        accession_info[row['ref_id']].append({'db':row['db'],'code':row['code'],'accession':row['accession']})
 
-            # Process headers in the loop
-            if current_loop and line.startswith('_'):
-                headers.append(line.strip().split('.')[1])
-                loop_id = line.split('.')[0]
-                continue
+    # Collect data for chain and databases
+    return {row['chain']: accession_info.get(row['ref_id'], []) for row in metadata_index.chains(pdb_code)}
 
-            # Process values in the loop
-            if current_loop and line.strip() and not line.startswith('_') and not line.startswith(';'):
-                values = []
-                values.extend(shlex.split(line))
-
-                if len(values) < len(headers):
-                    while len(values) < len(headers):
-                        print(len(headers),len(values),values)
-                        value = ""
-                        for continued_line in file:
-                            print(loop_id,continued_line.strip())
-                            if len(value) == 0 and ';' not in continued_line:
-                                values.extend(shlex.split(continued_line.strip()))
-                                print("END MULTILINE 2",continued_line.strip())
-                                break
-                            if len(value) > 0 and ';' in continued_line or '#' in continued_line:
-                                print("END MULTILINE 1",value)
-                                values.append(value)
-                                break
-                            else:
-                                value += continued_line.strip(';').strip()
-
-                if loop_id == '_struct_ref':
-                    db_name_index = headers.index('db_name')
-                    db_code_index = headers.index('db_code')
-                    ref_id_index = headers.index('id ')
-                    db_name = values[db_name_index]
-                    db_code = values[db_code_index]
-                    entity_id = values[ref_id_index]
-                    if accession_info[ref_id] is None: accession_info[ref_id] = []
-                    
-                    accession_info[ref_id].append({'db':db_name,'code':db_code})
-
-                if loop_id == '_struct_ref_seq':
-                    chain_id_index = headers.index('pdbx_strand_id')
-                    ref_id_index = headers.index('ref_id')
-                    ref_id = values[ref_id_index]
-                    chain_id = values[chain_id_index]
-
-                    chain_info[chain_id] = {'ref_id': ref_id, 'chain': chain_id}
-
-
-        # Collect data for chain and databases
-        for chain in chain_info:
-            acc = accession_info[chain['ref_id']]
-
-def analyze_cis_trans_isomerization(pdb_id, pymol):
+def analyze_cis_trans_isomerization(pdb_id, pymol, skipped=None):
+    # skipped collects {'chain', 'resi', 'reason'} of prolines that could not be measured
     prolines = []
 
     pymol.cmd.reinitialize()
-    pymol.cmd.fetch(pdb_id)
+    structure_store.load(pymol.cmd, pdb_id)
     chains = pymol.cmd.get_chains()
     chain_ids = []
     for chain in chains:
@@ -251,7 +122,7 @@ def analyze_cis_trans_isomerization(pdb_id, pymol):
 
         # Find the starting residue index for the chain
         start_resi = []
-        cmd.iterate(f"{chain_selection} and present", "start_resi.append(resi)", space={'start_resi': start_resi})
+        pymol.cmd.iterate(f"{chain_selection} and present", "start_resi.append(resi)", space={'start_resi': start_resi})
         if not start_resi:
             continue  # Skip if no residues found
 
@@ -284,7 +155,7 @@ def analyze_cis_trans_isomerization(pdb_id, pymol):
         for index in proline_indices:
             context = ""
             for c_idx in range(index-5,index+5):
-                aa = X
+                aa = 'X'
                 if c_idx >= 0 and c_idx in sequence:
                     aa = one_letter[sequence[c_idx]]
                 context += aa
@@ -310,11 +181,64 @@ def analyze_cis_trans_isomerization(pdb_id, pymol):
 
                     entry = {'chain':chain_id, 'resi':index, 'prev':aa_codes[prev_residue_type], 'context':context, 'omega':omega_angle}
                     prolines.append(entry)
-                except:
+                except Exception as e:
                     print(pdb_id,chain_id,index,'error')
+                    if skipped is not None: skipped.append({'chain':chain_id, 'resi':index, 'reason':repr(e)})
                 
     return prolines
 
+def analyze_cis_trans_isomerization_numpy(pdb_id, skipped=None):
+    # Same entries as analyze_cis_trans_isomerization, all omega angles of a chain in one vectorized computation.
+    # The preceding residue is the previous residue of the chain, so insertion codes are handled, and only the first
+    # alternative location of each atom is used. As in the PyMOL engine, prolines after a residue that is not in aa_codes
+    # (e.g. MSE) are skipped with the KeyError as reason, so both engines give the same totals
+    prolines = []
+
+    structure = omega_engine.load_structure(structure_store.get(pdb_id))
+    if structure is None: return prolines
+
+    for chain_id in omega_engine.chain_ids(structure):
+        residues = omega_engine.chain_residues(structure, chain_id)
+        has_ca = ~np.isnan(residues['CA'][:,0])
+        if np.count_nonzero(has_ca) >= 30: continue
+
+        start_resi = int(residues['resi'].min())
+        omegas = omega_engine.chain_omegas(residues)
+
+        sequence = {}
+        for resi, resn in zip(residues['resi'][has_ca], residues['resn'][has_ca]):
+            sequence[int(resi)] = resn
+
+        for k in np.flatnonzero(has_ca & (residues['resn'] == 'PRO')):
+            index = int(residues['resi'][k])
+            if index == start_resi: continue
+
+            context = ""
+            for c_idx in range(index-5,index+5):
+                aa = 'X'
+                if c_idx >= 0 and c_idx in sequence:
+                    aa = one_letter.get(sequence[c_idx], 'X')
+                context += aa
+
+            if k == 0 or np.isnan(omegas[k-1]):
+                print(pdb_id,chain_id,index,'no preceding residue')
+                if skipped is not None: skipped.append({'chain':chain_id, 'resi':index, 'reason':'no preceding residue'})
+                continue
+
+            omega_angle = float(omegas[k-1])
+            if omega_angle < -90: omega_angle += 360
+
+            prev_residue_type = str(residues['resn'][k-1])
+            if prev_residue_type not in aa_codes:
+                print(pdb_id,chain_id,index,'error')
+                if skipped is not None: skipped.append({'chain':chain_id, 'resi':index, 'reason':repr(KeyError(prev_residue_type))})
+                continue
+
+            entry = {'chain':chain_id, 'resi':index, 'prev':aa_codes[prev_residue_type], 'context':context, 'omega':omega_angle}
+            prolines.append(entry)
+
+    return prolines
+
 def group_data_by_resi(data):
     grouped_data = {}
     for item in data:
@@ -328,65 +252,176 @@ def group_data_by_resi(data):
     return [value for value in grouped_data.values()]
 
 
-def process():
-
-    data = {}
-    database = {}
-
-    with pymol2.PyMOL() as pymol:
-        ids = read_database('../pdb_lists/231129_sub30res_peptides.txt')[0:20]
+# Each worker process keeps its own PyMOL instance for all entries it scans, started when first needed
+worker_pymol = None
+
+def start_worker_pymol():
+    global worker_pymol
+    if worker_pymol is None:
+        worker_pymol = pymol2.PyMOL()
+        worker_pymol.start()
+    return worker_pymol
+
+def init_worker():
+    if ENGINE == 'pymol': start_worker_pymol()
+
+def scan_entry(id):
+    skipped = []
+    try:
+        if ENGINE == 'pymol': dat = analyze_cis_trans_isomerization(id, worker_pymol, skipped)
+        else: dat = analyze_cis_trans_isomerization_numpy(id, skipped)
+        return id, group_data_by_resi(dat), skipped, None
+    except Exception as e:
+        return id, None, skipped, repr(e)
+
+def scan_entries(ids, workers=WORKERS):
+    # Yields (id, grouped prolines, skipped prolines, error) as the entries finish, in any order
+    if workers is None or workers <= 1:
+        init_worker()
+        for id in ids:
+            yield scan_entry(id)
+        return
+
+    with Pool(workers, initializer=init_worker) as pool:
+        for result in pool.imap_unordered(scan_entry, ids, chunksize=CHUNKSIZE):
+            yield result
+
+def geometry_entry(id):
+    try:
+        structure = omega_engine.load_structure(structure_store.get(id))
+        if structure is None: return id, None, 'no atoms'
+        return id, omega_engine.structure_geometry(structure, one_letter), None
+    except Exception as e:
+        return id, None, repr(e)
+
+def geometry_entries(ids, workers=WORKERS):
+    # Yields (id, geometry, error) as the entries finish, in any order
+    if workers is None or workers <= 1:
+        for id in ids:
+            yield geometry_entry(id)
+        return
+
+    with Pool(workers) as pool:
+        for result in pool.imap_unordered(geometry_entry, ids, chunksize=CHUNKSIZE):
+            yield result
+
+def export_geometry(ids, workers=WORKERS, path=GEOMETRY_OUT):
+    # Columns of all residues of all entries in list order: pdb, chain, resi, icode, resn, phi, psi, omega, chi1, chi2,
+    # pucker, prev, context (see omega_engine.structure_geometry). Rows of an entry are found with a mask, e.g.
+    # geometry['pdb'] == '1abc', cis X-Pro bonds with (geometry['resn'] == 'PRO') & (np.abs(geometry['omega']) < 45)
+    tables = {}
+    for n, (id, geometry, error) in enumerate(geometry_entries(ids, workers)):
+        print(f'{n + 1}/{len(ids)}', id, 'error: ' + error if error else '')
+        if geometry is not None: tables[id] = geometry
+
+    ordered = [id for id in ids if id in tables]
+    columns = {'pdb': np.concatenate([np.full(len(tables[id]['resi']), id) for id in ordered]) if ordered else np.zeros(0, dtype='<U4')}
+    for name in ['chain', 'resi', 'icode', 'resn', 'phi', 'psi', 'omega', 'chi1', 'chi2', 'pucker', 'prev', 'context']:
+        columns[name] = np.concatenate([tables[id][name] for id in ordered]) if ordered else np.zeros(0)
+
+    np.savez_compressed(path, **columns)
+    print(f'{len(columns["pdb"])} residues of {len(ordered)} entries written to {path}')
+    return columns
+
+def load_geometry(path=GEOMETRY_OUT):
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+def read_journal(path):
+    # Finished entries {id: grouped prolines} and failed entries {id: reason}, the last record of an entry counts
+    done = {}
+    failed = {}
+    if not os.path.exists(path): return done, failed
 
-        #get_database(ids, pymol)
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue # Line cut short by an interrupted run
+            if 'error' in record:
+                failed[record['id']] = record['error']
+                done.pop(record['id'], None)
+            else:
+                done[record['id']] = record['prolines']
+                failed.pop(record['id'], None)
+    return done, failed
+
+def open_journal(path):
+    # Journal for appending. A last line cut short by an interrupted run is removed first, otherwise the next record
+    # would be appended to it and lost when the journal is read
+    if os.path.exists(path):
+        with open(path, 'rb+') as f:
+            data = f.read()
+            if len(data) > 0 and not data.endswith(b'\n'): f.truncate(data.rfind(b'\n') + 1)
+    return open(path, 'a')
+
+def write_journal(journal, record):
+    journal.write(json.dumps(record) + '\n')
+    journal.flush()
+
+def process(workers=WORKERS, max_ids=MAX_IDS, resume=True, retry=False):
+    # resume: skip the entries finished in JOURNAL_OUT, otherwise start a new journal
+    # retry: scan the entries recorded as failed again, otherwise they are skipped as well
 
-        for id in ids:
-            print(id)
-            #chain_information = parse_cif_for_chain_info(id)
-
-            #database[id] = {'info':chain_information,'data':[]}
-
-            dat = analyze_cis_trans_isomerization(id, pymol)
-            database[id] = group_data_by_resi(dat)
-
-        with open('../database.json','w') as json_file:
-            json.dump(database, json_file)
-
-        totalcomplexes = 0
-        totalchains = 0
-        prolines = 0
-        cisprolines = 0
-        transprolines = 0
-        prolinecontainingpeptides = 0
-        cisprolinecontainingpeptides = 0
-
-    with open('../pdb_angles.txt','w') as f:
-        for id in database:
-            entry = database[id]
-            if len(entry) > 0:
-                prolinecontainingpeptides += 1
-
-                for proline in entry:
-                    out = id + '_' + str(proline['resi']) + ','
-                    prolines += 1
-
-                    cis = False
-                    trans = False
-
-                    for omega in proline['omegas']:
-                        out += str(omega) + ','
-
-                        if abs(omega) < 45: cis = True
-                        elif abs(omega) > 135 and abs(omega) < 225: trans = True
-                    
-                    if cis: cisprolines += 1
-                    if trans: transprolines += 1
-                
-                    f.write(out.strip(',') + '\n')
+    database = {}
 
-    print('IDs:',len(ids))
-    print('Total Complexes Analyzed:   ',len(database))
-    print('Total Prolines Found:       ',prolines)
-    print('Proline Containing Peptides:',prolinecontainingpeptides)
-    print('Total Trans Prolines:       ',transprolines)
-    print('Total Cis Prolines:         ',cisprolines)
+    ids = read_database(DATABASE_LIST)
+    if max_ids is not None: ids = ids[0:max_ids]
+
+    if not resume and os.path.exists(JOURNAL_OUT): os.remove(JOURNAL_OUT)
+    done, failed = read_journal(JOURNAL_OUT)
+    todo = [id for id in ids if id not in done and (retry or id not in failed)]
+    print(f'{len(ids)} entries: {len(ids) - len(todo)} in journal, {len(todo)} to scan')
+
+    with open_journal(JOURNAL_OUT) as journal:
+        # Read structures from the local store, missing entries are fetched once here and not by the workers
+        unavailable = get_database(todo)
+        print(structure_store.format_stats())
+        for id in unavailable:
+            failed[id] = 'not available in the structure store'
+            write_journal(journal, {'id':id, 'error':failed[id]})
+        if len(unavailable) > 0:
+            print('Not available:', ','.join(unavailable))
+            todo = [id for id in todo if id not in unavailable]
+
+        # Journal entries as they finish, so an interrupted scan continues where it stopped
+        for n, (id, grouped, skipped, error) in enumerate(scan_entries(todo, workers)):
+            print(f'{n + 1}/{len(todo)}', id, 'error: ' + error if error else '')
+            if error:
+                failed[id] = error
+                write_journal(journal, {'id':id, 'error':error})
+                continue
 
-process()
\ No newline at end of file
+            write_journal(journal, {'id':id, 'prolines':grouped, 'skipped':skipped})
+            done[id] = grouped
+            failed.pop(id, None)
+
+    # Merge in the order of the list
+    for id in ids:
+        if id in done: database[id] = done[id]
+
+    failed = {id: failed[id] for id in ids if id in failed}
+    if len(failed) > 0:
+        print(f'{len(failed)} entries failed, see {JOURNAL_OUT} (rerun with -retry to scan them again):')
+        for id in failed: print(' ', id, failed[id])
+
+    with open(DATABASE_OUT,'w') as json_file:
+        json.dump(database, json_file)
+
+    # Statistics of all omega angles as arrays
+    records = omega_statistics.load_records(database)
+    omega_statistics.write_angles(ANGLES_OUT, records)
+    omega_statistics.export_tables(STATISTICS_OUT, records)
+    print(omega_statistics.format_summary(records, len(ids)))
+
+if __name__ == '__main__':
+    # -fresh: start a new journal instead of resuming, -retry: scan failed entries again
+    # -geometry: export the geometry of all residues of the list to GEOMETRY_OUT instead of scanning prolines
+    args = sys.argv
+    if '-geometry' in args:
+        ids = read_database(DATABASE_LIST)
+        if MAX_IDS is not None: ids = ids[0:MAX_IDS]
+        unavailable = get_database(ids)
+        export_geometry([id for id in ids if id not in unavailable])
+    else: process(resume='-fresh' not in args, retry='-retry' in args)
\ No newline at end of file
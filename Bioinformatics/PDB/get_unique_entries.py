@@ -1,4 +1,15 @@
+import json
+import os
+import sys
+from multiprocessing import Pool
+import sequence_clustering
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import peptide_index
+
 FILE = 'cis'
+WORKERS = os.cpu_count() # Groups are processed in parallel, 1 processes them in this process
+CHUNKSIZE = 8 # Groups handed to a worker at a time
 
 def levenshtein_distance(s1, s2):
     if len(s1) < len(s2):
@@ -26,14 +37,9 @@ def levenshtein_distance(s1, s2):
 def count_unique_strings(amino_acid_strings):
     unique_strings = set(amino_acid_strings)  # Remove exact duplicates first
 
-    # Prepare to track non-unique strings
-    non_unique_strings = set()
-
-    for s1 in unique_strings:
-        for s2 in unique_strings:
-            if s1 != s2 and s1 in s2:
-                non_unique_strings.add(s1)
-                break
+    # Strings contained in another string are not unique, containment of all strings from one index
+    index = peptide_index.ContainmentIndex(unique_strings)
+    non_unique_strings = set([s1 for s1 in unique_strings if len(index.containers(s1)) > 1])
 
     # Filter out non-unique strings to get the final list of unique strings
     final_unique_strings = unique_strings - non_unique_strings
@@ -46,13 +52,11 @@ def count_lenient_unique_strings(amino_acid_strings, tolerance=2):
     if len(unique_strings) == 1:
     	return 1, unique_strings
 
-    non_unique_strings = set()
-
-    for s1 in unique_strings:
-        for s2 in unique_strings:
-            if s1 != s2 and levenshtein_distance(s1, s2) <= int(0.1 * len(s1)) + 0.5:
-                non_unique_strings.add(s1)
-                break
+    # A string is not unique if any other string is within int(0.1 * len(s1)) + 0.5, see sequence_clustering.py
+    strings = list(unique_strings)
+    others = sequence_clustering.RetainedSet(len(strings))
+    for s in strings: others.add(s)
+    non_unique_strings = set([s1 for i, s1 in enumerate(strings) if others.any_within(s1, int(0.1 * len(s1)), skip = i)])
 
     # Filter out non-unique strings to get the final list of unique strings
     final_unique_strings = unique_strings - non_unique_strings
@@ -60,51 +64,54 @@ def count_lenient_unique_strings(amino_acid_strings, tolerance=2):
     return len(final_unique_strings), final_unique_strings
 
 def retain_one_similar_string(amino_acid_strings, tolerance=0.2):
-    retained_strings = []  # This will store the strings we decide to keep
+    # Greedy retention, a string is kept unless it is within tolerance * len(s1) of a string kept before it.
+    # Same result as comparing levenshtein_distance to every kept string, see sequence_clustering.py
+    return sequence_clustering.retain_one_similar_string(amino_acid_strings, tolerance)
 
-    for s1 in amino_acid_strings:
-        keep_s1 = True
-        for s2 in retained_strings:
-            if levenshtein_distance(s1, s2) <= tolerance * len(s1):
-                keep_s1 = False
-                break
-        if keep_s1:
-            retained_strings.append(s1)
-
-    return len(retained_strings), retained_strings
-
-def script():
-	unique = 0
-	peptides = []
+def read_groups(path):
+	# [(peptides, ids), ...] of each group, in the order of the file. A group is taken at every empty line after it
 	groups = []
-	unique_ids = []
-
-
-	with open(FILE + '_groups.txt') as f:
+	with open(path) as f:
 		group = []
 		ids = []
 
 		for line in f:
 			line = line.strip()
 			if line == "" and len(group) > 0:
-
-				n, p = retain_one_similar_string(group)
-				unique += n
-				peptides.extend(p)
-				group_ids = []
-
-				for i in range(len(group)):
-					if group[i] in p: group_ids.append(ids[i])
-
-				groups.append([len(groups) + 1, n, p,  group_ids])
-
+				groups.append((list(group), list(ids)))
 			elif "GROUP" in line:
 				group = []
 				ids = []
 			elif line != "":
 				group.append(line.split('|')[1])
 				ids.append(line.split('|')[0])
+	return groups
 
+def process_group(group_and_ids):
+	group, ids = group_and_ids
+	n, p = retain_one_similar_string(group)
+	group_ids = []
+
+	for i in range(len(group)):
+		if group[i] in p: group_ids.append(ids[i])
+
+	return n, p, group_ids
+
+def process_groups(groups, workers=WORKERS):
+	# Results of process_group in the order of the groups, groups are independent so they run in a process pool
+	if workers is None or workers <= 1 or len(groups) < 2: return [process_group(g) for g in groups]
+	with Pool(workers) as pool:
+		return pool.map(process_group, groups, chunksize=CHUNKSIZE)
+
+def script():
+	unique = 0
+	peptides = []
+	groups = []
+
+	for n, p, group_ids in process_groups(read_groups(FILE + '_groups.txt')):
+		unique += n
+		peptides.extend(p)
+		groups.append([len(groups) + 1, n, p,  group_ids])
 
 	print(unique)
 
@@ -120,6 +127,15 @@ def script():
 				out += str(v) + ","
 			f.write(out[0:-1] + ']\n')
 
+	# Same groups as structured files
+	with open(FILE + '_peptides_unique_groups.json','w') as f:
+		json.dump([{'group': g[0], 'unique': g[1], 'peptides': g[2], 'ids': g[3]} for g in groups], f, indent=1)
+
+	with open(FILE + '_peptides_unique_groups.tsv','w') as f:
+		f.write('group\tunique\tpeptides\tids\n')
+		for g in groups:
+			f.write(f"{g[0]}\t{g[1]}\t{','.join(g[2])}\t{','.join(g[3])}\n")
+
 	with open(FILE + '_unique_ids.txt', 'w') as f:
 		for g in groups:
 			ids = g[3]
@@ -128,17 +144,17 @@ def script():
 				out += id.upper() + " "
 			f.write(out + '\n')
 
-FILE = 'cis'
-
-script()
+if __name__ == '__main__':
+	FILE = 'cis'
 
-print("CIS DONE")
+	script()
 
-FILE = 'trans'
+	print("CIS DONE")
 
-script()
+	FILE = 'trans'
 
-print("TRANS DONE")
+	script()
 
-print("SCRIPT DONE")
+	print("TRANS DONE")
 
+	print("SCRIPT DONE")
@@ -0,0 +1,236 @@
+# NumPy structure loader and backbone dihedral engine
+# Reads the atoms of the first model of a local mmCIF or PDB file (optionally gzip compressed) into arrays and
+# computes all peptide bond omega angles of a chain in one vectorized dihedral computation.
+# Frederik Friis Theisen 2024, University of Copenhagen
+
+import gzip
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import cif_parser
+
+BLANK = {'.', '?'}
+PEPTIDE_BOND_MAX = 2.0 # Angstrom, longer C-N distances are chain breaks
+
+def open_structure_file(path):
+    if path.endswith('.gz'): return gzip.open(path, 'rt')
+    return open(path)
+
+def read_atom_site_cif(path):
+    # Columns of the _atom_site loop as lists of strings
+    return cif_parser.read_categories(path, ['_atom_site']).get('_atom_site', {})
+
+def structure_from_cif(path):
+    columns = read_atom_site_cif(path)
+    if len(columns) == 0: return None
+
+    def column(*names, default = ''):
+        for name in names:
+            if name in columns: return columns[name]
+        return [default] * len(columns['Cartn_x'])
+
+    return build_structure(
+        group = column('group_PDB', default = 'ATOM'),
+        atom = column('auth_atom_id', 'label_atom_id'),
+        altloc = column('label_alt_id'),
+        resn = column('auth_comp_id', 'label_comp_id'),
+        chain = column('auth_asym_id', 'label_asym_id'),
+        resi = column('auth_seq_id', 'label_seq_id'),
+        icode = column('pdbx_PDB_ins_code'),
+        model = column('pdbx_PDB_model_num', default = '1'),
+        xyz = [columns['Cartn_x'], columns['Cartn_y'], columns['Cartn_z']])
+
+def structure_from_pdb(path):
+    fields = {key: [] for key in ['group', 'atom', 'altloc', 'resn', 'chain', 'resi', 'icode']}
+    x, y, z = [], [], []
+
+    with open_structure_file(path) as f:
+        for line in f:
+            if line.startswith('ENDMDL'): break # First model only
+            if not (line.startswith('ATOM') or line.startswith('HETATM')): continue
+            fields['group'].append(line[0:6].strip())
+            fields['atom'].append(line[12:16].strip())
+            fields['altloc'].append(line[16].strip())
+            fields['resn'].append(line[17:20].strip())
+            fields['chain'].append(line[21].strip())
+            fields['resi'].append(line[22:26].strip())
+            fields['icode'].append(line[26].strip())
+            x.append(line[30:38])
+            y.append(line[38:46])
+            z.append(line[46:54])
+
+    if len(x) == 0: return None
+    return build_structure(model = ['1'] * len(x), xyz = [x, y, z], **fields)
+
+def build_structure(group, atom, altloc, resn, chain, resi, icode, model, xyz):
+    # Dictionary of atom arrays. First model only, and of alternative locations only the first one of each atom
+    structure = {
+        'group': np.array(group),
+        'atom': np.array(atom),
+        'altloc': np.array(['' if v in BLANK else v for v in altloc]),
+        'resn': np.array(resn),
+        'chain': np.array(chain),
+        'resi': np.array([int(v) if v not in BLANK else -99999 for v in resi]),
+        'icode': np.array(['' if v in BLANK else v for v in icode]),
+        'model': np.array(model),
+        'xyz': np.array(xyz, dtype = float).T,
+    }
+
+    keep = structure['model'] == structure['model'][0]
+
+    # Atom identity without the alternative location, keep the first occurrence in the file
+    keys = np.char.add(np.char.add(np.char.add(structure['chain'], '|'), np.char.add(structure['resi'].astype(str), structure['icode'])), np.char.add('|', structure['atom']))
+    alternative = keep & (structure['altloc'] != '')
+    if np.any(alternative):
+        idx = np.flatnonzero(keep)
+        _, first = np.unique(keys[idx], return_index = True)
+        unique = np.zeros(len(keys), dtype = bool)
+        unique[idx[first]] = True
+        keep &= unique
+
+    return {key: value[keep] for key, value in structure.items()}
+
+def load_structure(path):
+    # mmCIF (.cif) or PDB (.pdb, .ent) file, optionally gzip compressed
+    name = path[:-3] if path.endswith('.gz') else path
+    if name.endswith('.pdb') or name.endswith('.ent'): return structure_from_pdb(path)
+    return structure_from_cif(path)
+
+def dihedrals(p0, p1, p2, p3):
+    # Dihedral angles in degrees (-180 to 180) of arrays of points (n x 3)
+    b0 = p0 - p1
+    b1 = p2 - p1
+    b2 = p3 - p2
+    b1 = b1 / np.linalg.norm(b1, axis = 1)[:, None]
+
+    v = b0 - np.sum(b0 * b1, axis = 1)[:, None] * b1
+    w = b2 - np.sum(b2 * b1, axis = 1)[:, None] * b1
+    x = np.sum(v * w, axis = 1)
+    y = np.sum(np.cross(b1, v) * w, axis = 1)
+    return np.degrees(np.arctan2(y, x))
+
+def chain_ids(structure):
+    return list(dict.fromkeys(structure['chain'].tolist()))
+
+def chain_residues(structure, chain, atoms = ('N', 'CA', 'C')):
+    # Residues of a chain in file order with the coordinates of the requested atoms (NaN if missing)
+    mask = structure['chain'] == chain
+    resi = structure['resi'][mask]
+    icode = structure['icode'][mask]
+    resn = structure['resn'][mask]
+    atom = structure['atom'][mask]
+    xyz = structure['xyz'][mask]
+
+    keys = np.char.add(resi.astype(str), np.char.add('|', icode))
+    _, first, inverse = np.unique(keys, return_index = True, return_inverse = True)
+    order = np.argsort(first)
+    rank = np.empty(len(order), dtype = int)
+    rank[order] = np.arange(len(order))
+    index = rank[inverse.ravel()] # Residue index of each atom in file order
+
+    residues = {'resi': resi[first[order]], 'icode': icode[first[order]], 'resn': resn[first[order]]}
+    for name in atoms:
+        coordinates = np.full((len(order), 3), np.nan)
+        selected = atom == name
+        coordinates[index[selected][::-1]] = xyz[selected][::-1] # First atom wins
+        residues[name] = coordinates
+
+    return residues
+
+def chain_omegas(residues):
+    # Omega angle of the peptide bond from each residue to the next, CA(i) C(i) N(i+1) CA(i+1), NaN at chain breaks
+    omega = np.full(len(residues['resi']), np.nan)
+    if len(omega) < 2: return omega
+
+    c = residues['C'][:-1]
+    n = residues['N'][1:]
+    with np.errstate(invalid = 'ignore'):
+        angles = dihedrals(residues['CA'][:-1], c, n, residues['CA'][1:])
+        bonded = np.linalg.norm(n - c, axis = 1) < PEPTIDE_BOND_MAX
+    omega[:-1] = np.where(bonded, angles, np.nan)
+    return omega
+
+def structure_residues(structure, atoms = ('N', 'CA', 'C', 'CB', 'CG', 'CD')):
+    # Residues of all chains in file order with the coordinates of the requested atoms (NaN if missing), like
+    # chain_residues but for the whole structure at once
+    keys = np.char.add(np.char.add(structure['chain'], '|'), np.char.add(structure['resi'].astype(str), np.char.add('|', structure['icode'])))
+    _, first, inverse = np.unique(keys, return_index = True, return_inverse = True)
+    order = np.argsort(first)
+    rank = np.empty(len(order), dtype = int)
+    rank[order] = np.arange(len(order))
+    index = rank[inverse.ravel()]
+
+    residues = {name: structure[name][first[order]] for name in ['chain', 'resi', 'icode', 'resn']}
+    for name in atoms:
+        coordinates = np.full((len(order), 3), np.nan)
+        selected = structure['atom'] == name
+        coordinates[index[selected][::-1]] = structure['xyz'][selected][::-1] # First atom wins
+        residues[name] = coordinates
+
+    return residues
+
+def residue_context(residues, codes, width = 5):
+    # Sequence context of each residue by residue number as in the proline analyses: residue numbers resi-width to
+    # resi+width-1 of the same chain, X for negative or missing numbers. With several residues of one number
+    # (insertion codes) the last one in the file is used
+    n = len(residues['resi'])
+    offsets = np.arange(-width, width)
+    letters = np.full((n, 2 * width), 'X', dtype = '<U1')
+    for chain in np.unique(residues['chain']):
+        rows = np.flatnonzero(residues['chain'] == chain)
+        resi = residues['resi'][rows]
+        numbers, last = np.unique(resi[::-1], return_index = True)
+        chain_codes = codes[rows][::-1][last]
+
+        window = resi[:, None] + offsets[None, :]
+        position = np.clip(np.searchsorted(numbers, window), 0, len(numbers) - 1)
+        found = (window >= 0) & (numbers[position] == window)
+        letters[rows] = np.where(found, chain_codes[position], 'X')
+    return np.ascontiguousarray(letters).view(f'<U{2 * width}').ravel()
+
+def structure_geometry(structure, one_letter = {}):
+    # Backbone and proline ring geometry of every amino acid residue (with N, CA and C atoms) of all chains, computed in one vectorized pass:
+    # phi C(i-1) N CA C, psi N CA C N(i+1), omega CA(i-1) C(i-1) N CA (the peptide bond preceding the residue),
+    # chi1 N CA CB CG, chi2 CA CB CG CD, proline pucker ('endo' chi1 > 0, 'exo' chi1 < 0) and the sequence context
+    # (residue numbers resi-5 to resi+4, see residue_context). Angles are NaN when atoms are missing or at chain breaks
+    residues = structure_residues(structure)
+
+    # Context from all residues with a CA atom, as the sequence of the proline analyses
+    has_ca = ~np.isnan(residues['CA'][:, 0])
+    residues = {name: value[has_ca] for name, value in residues.items()}
+    codes = np.array([one_letter.get(resn, 'X') for resn in residues['resn'].tolist()], dtype = '<U1')
+    context = residue_context(residues, codes)
+
+    # Amino acid residues only: a calcium ion is also an atom named CA, so N and C are required as well
+    backbone = ~np.isnan(residues['N'][:, 0]) & ~np.isnan(residues['C'][:, 0])
+    residues = {name: value[backbone] for name, value in residues.items()}
+    n = len(residues['resi'])
+
+    geometry = {name: residues[name] for name in ['chain', 'resi', 'icode', 'resn']}
+    for name in ['phi', 'psi', 'omega']:
+        geometry[name] = np.full(n, np.nan)
+
+    with np.errstate(invalid = 'ignore'):
+        if n > 1:
+            # Peptide bond from residue i to i+1
+            same_chain = residues['chain'][:-1] == residues['chain'][1:]
+            bonded = same_chain & (np.linalg.norm(residues['N'][1:] - residues['C'][:-1], axis = 1) < PEPTIDE_BOND_MAX)
+            phi = dihedrals(residues['C'][:-1], residues['N'][1:], residues['CA'][1:], residues['C'][1:])
+            psi = dihedrals(residues['N'][:-1], residues['CA'][:-1], residues['C'][:-1], residues['N'][1:])
+            omega = dihedrals(residues['CA'][:-1], residues['C'][:-1], residues['N'][1:], residues['CA'][1:])
+            geometry['phi'][1:] = np.where(bonded, phi, np.nan)
+            geometry['omega'][1:] = np.where(bonded, omega, np.nan)
+            geometry['psi'][:-1] = np.where(bonded, psi, np.nan)
+
+        geometry['chi1'] = dihedrals(residues['N'], residues['CA'], residues['CB'], residues['CG']) if n > 0 else np.zeros(0)
+        geometry['chi2'] = dihedrals(residues['CA'], residues['CB'], residues['CG'], residues['CD']) if n > 0 else np.zeros(0)
+
+    proline = residues['resn'] == 'PRO'
+    geometry['pucker'] = np.where(proline & (geometry['chi1'] > 0), 'endo', np.where(proline & (geometry['chi1'] < 0), 'exo', ''))
+
+    geometry['prev'] = np.concatenate([[''], residues['resn'][:-1]]) if n > 0 else residues['resn']
+    geometry['prev'] = np.where(np.isnan(geometry['omega']), '', geometry['prev'])
+    geometry['context'] = context[backbone]
+    return geometry
@@ -0,0 +1,190 @@
+# Cis/trans statistics of the X-Pro omega angle database
+# Loads all omega records of database.json (or of the scan journal) into flat arrays once. Classification, counts by
+# preceding residue or context motif and the consistency of prolines measured in several chains of an entry are then
+# grouped array operations, and the summary tables are written as tab separated files.
+#
+# Usage:
+# python3 omega_statistics.py <database.json or journal .jsonl> <output prefix> [-motif start:end]
+#
+# Frederik Friis Theisen 2024, University of Copenhagen
+
+import json
+import sys
+import numpy as np
+
+CIS_MAX = 45 # abs(omega) below is cis
+TRANS_MIN = 135 # abs(omega) between TRANS_MIN and TRANS_MAX is trans
+TRANS_MAX = 225
+MOTIF = (3, 7) # Default context motif, residues -2 to +1 around the proline (context index 5)
+
+def read_database(path):
+    # {id: grouped prolines} from database.json or from the journal written by analysis_cistrans_pdb.process
+    if not path.endswith('.jsonl'):
+        with open(path) as f:
+            return json.load(f)
+
+    database = {}
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if 'error' in record: database.pop(record['id'], None)
+            else: database[record['id']] = record['prolines']
+    return database
+
+def load_records(database):
+    # One row per measured omega angle: pdb, resi, prev, context, chain, omega and the proline group it belongs to.
+    # A group is one entry of the grouped prolines (same resi and preceding residue, all chains of the entry). Groups
+    # without omega angles have no rows but are counted, their pdb and resi are kept per group
+    pdb, resi, prev, context, chain, omega, group = [], [], [], [], [], [], []
+    group_pdb, group_resi = [], []
+    entries = []
+    entry_groups = []
+    n = 0
+    for id in database:
+        entries.append(id)
+        entry_groups.append(len(database[id]))
+        for proline in database[id]:
+            count = len(proline['omegas'])
+            pdb += [id] * count
+            resi += [proline['resi']] * count
+            prev += [proline['prev']] * count
+            context += [proline['context']] * count
+            chain += proline.get('chains', [''] * count)
+            omega += proline['omegas']
+            group += [n] * count
+            group_pdb.append(id)
+            group_resi.append(proline['resi'])
+            n += 1
+
+    return {
+        'pdb': np.array(pdb, dtype = str),
+        'resi': np.array(resi, dtype = int),
+        'prev': np.array(prev, dtype = str),
+        'context': np.array(context, dtype = str),
+        'chain': np.array(chain, dtype = str),
+        'omega': np.array(omega, dtype = float),
+        'group': np.array(group, dtype = int),
+        'groups': n,
+        'group_pdb': np.array(group_pdb, dtype = str),
+        'group_resi': np.array(group_resi, dtype = int),
+        'entries': np.array(entries, dtype = str),
+        'entry_groups': np.array(entry_groups, dtype = int),
+    }
+
+def classify(omega):
+    # 'cis', 'trans' or 'other' for each angle
+    magnitude = np.abs(omega)
+    cis = magnitude < CIS_MAX
+    trans = (magnitude > TRANS_MIN) & (magnitude < TRANS_MAX)
+    return np.where(cis, 'cis', np.where(trans, 'trans', 'other'))
+
+def group_any(records, mask):
+    # True for each proline group with any record in mask
+    return np.bincount(records['group'][mask], minlength = records['groups']) > 0
+
+def summary(records):
+    # Totals as printed by analysis_cistrans_pdb.process: prolines counted once per group, cis (trans) if any of its
+    # chains is cis (trans)
+    classes = classify(records['omega'])
+    return {
+        'entries': len(records['entries']),
+        'prolines': records['groups'],
+        'proline_entries': int(np.count_nonzero(records['entry_groups'] > 0)),
+        'cis': int(np.count_nonzero(group_any(records, classes == 'cis'))),
+        'trans': int(np.count_nonzero(group_any(records, classes == 'trans'))),
+    }
+
+def counts_by(records, keys):
+    # Number of cis, trans and other angles for each distinct key, keys is an array with one value per record.
+    # Returns the distinct keys and a (keys x 3) count array in the order cis, trans, other
+    classes = np.searchsorted(['cis', 'other', 'trans'], classify(records['omega']))
+    columns = np.array([0, 2, 1])[classes] # cis, trans, other
+    distinct, inverse = np.unique(keys, return_inverse = True)
+    counts = np.zeros((len(distinct), 3), dtype = int)
+    np.add.at(counts, (inverse.ravel(), columns), 1)
+    return distinct, counts
+
+def motifs(records, start = MOTIF[0], end = MOTIF[1]):
+    # Slice of the sequence context of each record
+    return np.array([context[start:end] for context in records['context'].tolist()], dtype = str)
+
+def consistency(records):
+    # Prolines measured in more than one chain of an entry, and whether all their chains agree on cis/trans/other.
+    # Returns the group ids, number of chains and a boolean array of agreement
+    classes = np.searchsorted(['cis', 'other', 'trans'], classify(records['omega']))
+    chains = np.bincount(records['group'], minlength = records['groups'])
+    lowest = np.full(records['groups'], 3)
+    highest = np.full(records['groups'], -1)
+    np.minimum.at(lowest, records['group'], classes)
+    np.maximum.at(highest, records['group'], classes)
+    multiple = np.flatnonzero(chains > 1)
+    return multiple, chains[multiple], lowest[multiple] == highest[multiple]
+
+def write_counts(path, header, keys, counts):
+    with open(path, 'w') as f:
+        f.write(f'{header}\tcis\ttrans\tother\tcis_fraction\n')
+        for key, (cis, trans, other) in zip(keys.tolist(), counts.tolist()):
+            total = cis + trans + other
+            f.write(f'{key}\t{cis}\t{trans}\t{other}\t{cis / total if total > 0 else 0:.4f}\n')
+
+def write_angles(path, records):
+    # Lines <id>_<resi>,<omega>,<omega>,... of each proline group, as written by analysis_cistrans_pdb.process. A group
+    # without angles is written as <id>_<resi>
+    order = np.argsort(records['group'], kind = 'stable')
+    boundaries = np.cumsum(np.bincount(records['group'], minlength = records['groups']))[:-1]
+    with open(path, 'w') as f:
+        for g, rows in zip(range(records['groups']), np.split(order, boundaries)):
+            values = [str(records['group_pdb'][g]) + '_' + str(records['group_resi'][g])] + [str(v) for v in records['omega'][rows].tolist()]
+            f.write(','.join(values) + '\n')
+
+def export_tables(prefix, records, motif = MOTIF):
+    # <prefix>_by_prev.tsv, <prefix>_by_motif.tsv and <prefix>_consistency.tsv
+    keys, counts = counts_by(records, records['prev'])
+    write_counts(prefix + '_by_prev.tsv', 'prev', keys, counts)
+
+    keys, counts = counts_by(records, motifs(records, *motif))
+    write_counts(prefix + '_by_motif.tsv', 'motif', keys, counts)
+
+    groups, chains, agree = consistency(records)
+    first = np.unique(records['group'], return_index = True)[1]
+    with open(prefix + '_consistency.tsv', 'w') as f:
+        f.write('pdb\tresi\tprev\tchains\tconsistent\n')
+        for group, count, same in zip(groups.tolist(), chains.tolist(), agree.tolist()):
+            row = first[group]
+            f.write(f"{records['pdb'][row]}\t{records['resi'][row]}\t{records['prev'][row]}\t{count}\t{int(same)}\n")
+
+def format_summary(records, ids = None):
+    totals = summary(records)
+    groups, _, agree = consistency(records)
+    lines = []
+    if ids is not None: lines.append(f'IDs: {ids}')
+    lines += [
+        f"Total Complexes Analyzed:    {totals['entries']}",
+        f"Total Prolines Found:        {totals['prolines']}",
+        f"Proline Containing Peptides: {totals['proline_entries']}",
+        f"Total Trans Prolines:        {totals['trans']}",
+        f"Total Cis Prolines:          {totals['cis']}",
+        f"Multi-chain Prolines:        {len(groups)} ({int(np.count_nonzero(agree))} consistent)",
+    ]
+    return '\n'.join(lines)
+
+def main():
+    args = sys.argv
+    if len(args) < 3:
+        print('Usage: python3 omega_statistics.py <database.json or journal .jsonl> <output prefix> [-motif start:end]')
+        return
+
+    motif = MOTIF
+    if '-motif' in args:
+        idx = args.index('-motif')
+        motif = tuple([int(v) for v in args[idx + 1].split(':')])
+
+    records = load_records(read_database(args[1]))
+    export_tables(args[2], records, motif)
+    print(format_summary(records))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+# Sequence redundancy clustering engine for get_unique_entries.py
+# Decides "levenshtein_distance(s1, s2) <= k" (edit distance, 0 when the shorter string is contained in the longer)
+# without computing full distances for every pair:
+#   1. containment and length difference checks (the distance is at least the length difference)
+#   2. q-gram filter, vectorized over all candidates: strings within distance k share at least
+#      max(len) - q + 1 - k * q q-grams
+#   3. for the remaining pairs a banded Levenshtein with early exit once the band exceeds k, or, for many pairs at
+#      once, a NumPy dynamic programming over all pairs in one array (row by row, with a running minimum for the
+#      insertions along the row)
+# Frederik Friis Theisen 2024, University of Copenhagen
+
+import math
+import numpy as np
+
+Q = 2 # q-gram length of the filter
+BUCKETS = 1024 # q-grams are hashed into this many counters, collisions only make the filter more permissive
+BATCH_MIN = 8 # Candidate pairs from which the NumPy batch is used instead of the banded distance per pair
+PAD = np.uint32(0xFFFFFFFF) # Padding code of shorter candidates in the batch, never equal to a character
+
+def codes(s):
+    return np.frombuffer(s.encode('utf-32-le'), dtype = np.uint32)
+
+def qgram_profile(s):
+    # Hashed q-gram counts of a string
+    profile = np.zeros(BUCKETS, dtype = np.int32)
+    c = codes(s).astype(np.int64)
+    if len(c) >= Q:
+        h = np.zeros(len(c) - Q + 1, dtype = np.int64)
+        for i in range(Q):
+            h = h * 31 + c[i:len(c) - Q + 1 + i]
+        np.add.at(profile, h % BUCKETS, 1)
+    return profile
+
+def contained(s1, s2):
+    # Shorter string contained in the longer, as in levenshtein_distance
+    if len(s1) < len(s2): return s1 in s2
+    return s2 in s1
+
+def banded_within(s1, s2, k):
+    # Plain Levenshtein distance <= k (no containment check), computing only the diagonal band of width k and
+    # stopping as soon as the whole band exceeds k
+    if len(s1) < len(s2): s1, s2 = s2, s1
+    m, n = len(s1), len(s2)
+    if m - n > k: return False
+
+    big = k + 1
+    previous = [j if j <= k else big for j in range(n + 1)]
+    for i in range(1, m + 1):
+        lo = max(1, i - k)
+        hi = min(n, i + k)
+        current = [big] * (n + 1)
+        if i <= k: current[0] = i
+        c1 = s1[i - 1]
+        best = current[0]
+        for j in range(lo, hi + 1):
+            value = previous[j - 1] + (c1 != s2[j - 1])
+            if previous[j] + 1 < value: value = previous[j] + 1
+            if current[j - 1] + 1 < value: value = current[j - 1] + 1
+            if value > big: value = big
+            current[j] = value
+            if value < best: best = value
+        if best > k: return False
+        previous = current
+    return previous[n] <= k
+
+def batch_within(s1, candidates, k):
+    # True if any candidate is within plain Levenshtein distance k of s1, all pairs in one DP array (pairs x columns)
+    lengths = np.array([len(s2) for s2 in candidates])
+    width = int(lengths.max())
+    b = np.full((len(candidates), width), PAD, dtype = np.uint32)
+    for row, s2 in enumerate(candidates):
+        b[row, :len(s2)] = codes(s2)
+
+    columns = np.arange(width + 1)
+    previous = np.broadcast_to(columns, (len(candidates), width + 1)).copy()
+    current = np.empty_like(previous)
+    for i, c in enumerate(codes(s1)):
+        # Substitution or deletion from the previous row, insertions are a running minimum along the row:
+        # current[j] = min over l <= j of (candidate[l] + j - l)
+        current[:, 0] = i + 1
+        np.minimum(previous[:, 1:] + 1, previous[:, :-1] + (b != c), out = current[:, 1:])
+        current -= columns
+        np.minimum.accumulate(current, axis = 1, out = current)
+        current += columns
+        if current.min() > k: return False # Distances never decrease from row to row
+        previous, current = current, previous
+
+    return bool(np.any(previous[np.arange(len(candidates)), lengths] <= k))
+
+class RetainedSet:
+    # Strings kept so far, with their lengths and q-gram profiles as arrays for the vectorized filters
+
+    def __init__(self, capacity):
+        self.strings = []
+        self.lengths = np.zeros(capacity, dtype = np.int64)
+        self.profiles = np.zeros((capacity, BUCKETS), dtype = np.int32)
+
+    def add(self, s):
+        n = len(self.strings)
+        self.strings.append(s)
+        self.lengths[n] = len(s)
+        self.profiles[n] = qgram_profile(s)
+
+    def any_within(self, s1, k, skip = None):
+        # True if levenshtein_distance(s1, s2) <= k for any kept string s2, except the one at index skip
+        n = len(self.strings)
+        if n == 0: return False
+
+        for i, s2 in enumerate(self.strings):
+            if i != skip and contained(s1, s2): return True
+
+        m = len(s1)
+        lengths = self.lengths[:n]
+        candidates = np.abs(lengths - m) <= k
+        if skip is not None: candidates[skip] = False
+
+        # Shared q-grams, counted with the multiplicity of both strings
+        shared = np.minimum(self.profiles[:n][candidates], qgram_profile(s1)[None, :]).sum(axis = 1)
+        needed = np.maximum(lengths[candidates], m) - Q + 1 - k * Q
+        index = np.flatnonzero(candidates)[shared >= needed]
+        if len(index) == 0: return False
+
+        if len(index) < BATCH_MIN:
+            for i in index:
+                if banded_within(s1, self.strings[i], k): return True
+            return False
+        return batch_within(s1, [self.strings[i] for i in index], k)
+
+def retain_one_similar_string(amino_acid_strings, tolerance=0.2):
+    # Same result as the greedy retention of get_unique_entries: a string is kept unless it is within
+    # tolerance * len(s1) of a string kept before it
+    retained = RetainedSet(len(amino_acid_strings))
+    for s1 in amino_acid_strings:
+        k = math.floor(tolerance * len(s1)) # Distances are integers, d <= x is d <= floor(x)
+        if not retained.any_within(s1, k): retained.add(s1)
+
+    return len(retained.strings), retained.strings
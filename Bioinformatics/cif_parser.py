@@ -0,0 +1,130 @@
+# Streaming mmCIF category reader
+# Reads only the requested categories of an mmCIF file in a single pass and stops as soon as they are all read.
+# Understands loops, single item categories, quoted values ('...' and "...") and ;-delimited text fields.
+# Lines of categories that are not requested are skipped without tokenizing them.
+# Frederik Friis Theisen 2024, University of Copenhagen
+
+import gzip
+import re
+
+TOKEN = re.compile(r"'(.*?)'(?=\s|$)|\"(.*?)\"(?=\s|$)|(\S+)")
+
+def tokenize(line):
+    # Values of one line, quotes removed, comments dropped
+    if "'" not in line and '"' not in line and '#' not in line: return line.split()
+
+    values = []
+    for match in TOKEN.finditer(line):
+        single, double, bare = match.groups()
+        if bare is not None:
+            if bare.startswith('#'): break
+            values.append(bare)
+        else: values.append(single if single is not None else double)
+    return values
+
+def open_cif(path):
+    if path.endswith('.gz'): return gzip.open(path, 'rt')
+    return open(path)
+
+def read_categories(source, categories, scan = None):
+    # Columns of the requested categories, {category: {item: [values]}}, e.g. read_categories(f, ['_entity']).
+    # source is a path (.cif or .cif.gz) or an open text file. scan(line) is called with every line until it returns
+    # True, reading only stops early when the scan is done as well
+    if isinstance(source, str):
+        with open_cif(source) as f:
+            return read_categories(f, categories, scan)
+
+    wanted = set(categories)
+    result = {}
+    completed = set()
+    scanning = scan is not None
+
+    loop = None # {'category', 'items', 'values'} of the current loop
+    in_header = False
+    single = None # Category of the current single item block
+    pending = None # Item of a single item category waiting for its value
+    text = None # Lines of the current text field
+    collect = False # Values of the current block are kept
+
+    def store(value):
+        nonlocal pending
+        if loop is not None: loop['values'].append(value)
+        elif pending is not None:
+            result.setdefault(single, {})[pending] = [value]
+            pending = None
+
+    def finish():
+        # End of the current loop or single item block
+        nonlocal loop, single
+        if loop is not None and collect:
+            n = len(loop['items'])
+            result[loop['category']] = {item: loop['values'][i::n] for i, item in enumerate(loop['items'])}
+            completed.add(loop['category'])
+        if single is not None and single in wanted: completed.add(single)
+        loop = None
+        single = None
+
+    for line in source:
+        if scanning and scan(line): scanning = False
+
+        first = line[:1]
+
+        if text is not None: # Inside a text field, lines are literal
+            if first == ';':
+                if collect: store(''.join(text).rstrip('\n'))
+                text = None
+            elif collect: text.append(line)
+            continue
+
+        if first == ';':
+            text = [line[1:]]
+            continue
+
+        if first == '#' or line.isspace() or line == '': continue
+
+        if first == '_':
+            values = tokenize(line)
+            category, _, item = values[0].partition('.')
+
+            if loop is not None and in_header:
+                loop['category'] = category
+                loop['items'].append(item)
+                collect = category in wanted
+                continue
+
+            # Single item category, value on the same line or on the next lines
+            if single != category:
+                finish()
+                if not scanning and wanted <= completed: break
+                single = category
+            collect = category in wanted
+            pending = item
+            if len(values) > 1: store(values[1])
+            continue
+
+        if line.startswith('loop_'):
+            finish()
+            if not scanning and wanted <= completed: break
+            loop = {'category': None, 'items': [], 'values': []}
+            in_header = True
+            continue
+
+        if line.startswith('data_') or line.startswith('save_'):
+            finish()
+            continue
+
+        in_header = False
+        if collect:
+            if loop is not None: loop['values'].extend(tokenize(line))
+            else:
+                for value in tokenize(line):
+                    store(value)
+
+    finish()
+    return result
+
+def rows(columns):
+    # Rows of a category as dictionaries
+    if not columns: return []
+    items = list(columns.keys())
+    return [dict(zip(items, values)) for values in zip(*[columns[item] for item in items])]
@@ -0,0 +1,184 @@
+# Persistent per-entry metadata index of the structure store (SQLite)
+# Chains, database references, entities and the lines mentioning 14-3-3 of every entry are read once from the mmCIF
+# in the structure store and kept in <store root>/metadata.sqlite. An entry is re-read only when its structure in the
+# store changed (the stored content hash differs), so the analyses look metadata up instead of parsing CIF text.
+#
+# Usage:
+# python3 metadata_index.py update <pdb ids or files with comma separated pdb ids>
+# python3 metadata_index.py show <pdb id>
+# python3 metadata_index.py accession <accession>
+#
+# The index file is $PDB_INDEX (default <store root>/metadata.sqlite).
+# Frederik Friis Theisen 2024, University of Copenhagen
+
+import os
+import re
+import sqlite3
+import sys
+
+import cif_parser
+import structure_store
+
+PATH = os.environ.get('PDB_INDEX', os.path.join(structure_store.ROOT, 'metadata.sqlite'))
+MENTION = '14-3-3' # Lines containing this text are kept for the isoform assignment
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (pdb_id TEXT PRIMARY KEY, digest TEXT);
+CREATE TABLE IF NOT EXISTS chains (pdb_id TEXT, chain TEXT, ref_id TEXT, length INTEGER, position INTEGER);
+CREATE TABLE IF NOT EXISTS refs (pdb_id TEXT, ref_id TEXT, db TEXT, code TEXT, accession TEXT, position INTEGER);
+CREATE TABLE IF NOT EXISTS entities (pdb_id TEXT, entity_id TEXT, type TEXT, src_method TEXT, description TEXT, formula_weight TEXT, position INTEGER);
+CREATE TABLE IF NOT EXISTS mentions (pdb_id TEXT, line TEXT, position INTEGER);
+CREATE INDEX IF NOT EXISTS chains_id ON chains (pdb_id, chain);
+CREATE INDEX IF NOT EXISTS refs_id ON refs (pdb_id);
+CREATE INDEX IF NOT EXISTS refs_accession ON refs (accession);
+CREATE INDEX IF NOT EXISTS entities_id ON entities (pdb_id);
+CREATE INDEX IF NOT EXISTS mentions_id ON mentions (pdb_id);
+'''
+TABLES = ['chains', 'refs', 'entities', 'mentions']
+
+connections = {} # Open connections of this process, {(pid, path): connection}
+
+def connect(path = None):
+    # Connection of this process, worker processes open their own
+    key = (os.getpid(), path or PATH)
+    if key not in connections:
+        os.makedirs(os.path.dirname(os.path.abspath(key[1])), exist_ok = True)
+        db = sqlite3.connect(key[1], timeout = 60)
+        db.executescript(SCHEMA)
+        connections[key] = db
+    return connections[key]
+
+def clean_resi(resi):
+    idx = re.sub(r"\D", "", resi)
+    if idx != '': return int(idx)
+    return None
+
+def read_entry(path):
+    # Metadata rows of one mmCIF file, read in a single pass
+    mentions = []
+
+    def scan(line):
+        if MENTION in line: mentions.append(line.rstrip('\n'))
+        return False
+
+    cif = cif_parser.read_categories(path, ['_struct_ref_seq', '_struct_ref', '_entity'], scan)
+
+    # Length of each chain is the sum of its aligned segments, ref_id of the last segment
+    chains = {}
+    for row in cif_parser.rows(cif.get('_struct_ref_seq')):
+        chain = row['pdbx_strand_id']
+        length = chains[chain][1] if chain in chains else 0
+        beg = clean_resi(row['pdbx_auth_seq_align_beg'])
+        end = clean_resi(row['pdbx_auth_seq_align_end'])
+        if beg != None and end != None: length += end - beg + 1
+        chains[chain] = (row['ref_id'], length)
+
+    refs = [(row['id'], row.get('db_name'), row.get('db_code'), row.get('pdbx_db_accession')) for row in cif_parser.rows(cif.get('_struct_ref'))]
+    entities = [(row['id'], row.get('type'), row.get('src_method'), row.get('pdbx_description'), row.get('formula_weight')) for row in cif_parser.rows(cif.get('_entity'))]
+
+    return {
+        'chains': [(chain, ref_id, length) for chain, (ref_id, length) in chains.items()],
+        'refs': refs,
+        'entities': entities,
+        'mentions': [(line,) for line in mentions],
+    }
+
+def index_entry(db, pdb_id, digest, path):
+    pdb_id = structure_store.normalize_id(pdb_id)
+    data = read_entry(path)
+    with db:
+        for table in TABLES:
+            db.execute(f'DELETE FROM {table} WHERE pdb_id = ?', (pdb_id,))
+            rows = [(pdb_id,) + row + (i,) for i, row in enumerate(data[table])]
+            if len(rows) > 0: db.executemany(f'INSERT INTO {table} VALUES ({",".join(["?"] * len(rows[0]))})', rows)
+        db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?)', (pdb_id, digest))
+
+def stored_digest(pdb_id):
+    path = structure_store.lookup(pdb_id)
+    if path is None: return None, None
+    return os.path.basename(path).split('.')[0], path
+
+def update(pdb_ids, path = None):
+    # Index the entries that are new or changed in the store, returns the number of entries read
+    db = connect(path)
+    indexed = dict(db.execute('SELECT pdb_id, digest FROM entries').fetchall())
+    count = 0
+    for pdb_id in dict.fromkeys([structure_store.normalize_id(pdb_id) for pdb_id in pdb_ids if pdb_id.strip() != '']):
+        digest, cif = stored_digest(pdb_id)
+        if digest is None or indexed.get(pdb_id) == digest: continue
+        index_entry(db, pdb_id, digest, cif)
+        count += 1
+    return count
+
+def ensure(pdb_id, path = None):
+    # Index an entry if it is missing or outdated, the structure is fetched into the store if needed
+    db = connect(path)
+    pdb_id = structure_store.normalize_id(pdb_id)
+    digest, cif = stored_digest(pdb_id)
+    if digest is None:
+        cif = structure_store.get(pdb_id)
+        digest = os.path.basename(cif).split('.')[0]
+    row = db.execute('SELECT digest FROM entries WHERE pdb_id = ?', (pdb_id,)).fetchone()
+    if row is None or row[0] != digest: index_entry(db, pdb_id, digest, cif)
+    return db, pdb_id
+
+def chains(pdb_id, chain = None, path = None):
+    # [{'chain', 'ref_id', 'length'}, ...] in file order, optionally of one chain
+    db, pdb_id = ensure(pdb_id, path)
+    query = 'SELECT chain, ref_id, length FROM chains WHERE pdb_id = ?'
+    parameters = (pdb_id,)
+    if chain is not None:
+        query += ' AND chain = ?'
+        parameters += (chain,)
+    return [{'chain': c, 'ref_id': r, 'length': l} for c, r, l in db.execute(query + ' ORDER BY position', parameters)]
+
+def refs(pdb_id, path = None):
+    # [{'ref_id', 'db', 'code', 'accession'}, ...] in file order
+    db, pdb_id = ensure(pdb_id, path)
+    rows = db.execute('SELECT ref_id, db, code, accession FROM refs WHERE pdb_id = ? ORDER BY position', (pdb_id,))
+    return [{'ref_id': r, 'db': d, 'code': c, 'accession': a} for r, d, c, a in rows]
+
+def entities(pdb_id, path = None):
+    # [{'id', 'type', 'src_method', 'description', 'formula_weight'}, ...] in file order, values as in the file
+    db, pdb_id = ensure(pdb_id, path)
+    rows = db.execute('SELECT entity_id, type, src_method, description, formula_weight FROM entities WHERE pdb_id = ? ORDER BY position', (pdb_id,))
+    return [{'id': i, 'type': t, 'src_method': s, 'description': d, 'formula_weight': w} for i, t, s, d, w in rows]
+
+def mentions(pdb_id, path = None):
+    # Lines of the file containing MENTION, in file order
+    db, pdb_id = ensure(pdb_id, path)
+    return [line for line, in db.execute('SELECT line FROM mentions WHERE pdb_id = ? ORDER BY position', (pdb_id,))]
+
+def find_accession(accession, path = None):
+    # Indexed (pdb id, chain) pairs referencing a database accession
+    db = connect(path)
+    rows = db.execute('SELECT DISTINCT chains.pdb_id, chains.chain FROM refs JOIN chains ON chains.pdb_id = refs.pdb_id AND chains.ref_id = refs.ref_id WHERE refs.accession = ? ORDER BY chains.pdb_id, chains.position', (accession,))
+    return rows.fetchall()
+
+def main():
+    args = sys.argv
+    if len(args) < 2:
+        print('Usage: python3 metadata_index.py update|show|accession <arguments>')
+        return
+
+    command = args[1]
+
+    if command == 'update':
+        ids = structure_store.read_id_arguments(args[2:])
+        count = update(ids)
+        print(f'{len(ids)} entries, {count} indexed ({PATH})')
+
+    elif command == 'show':
+        for pdb_id in args[2:]:
+            print(pdb_id)
+            for chain in chains(pdb_id): print('  chain', chain)
+            for ref in refs(pdb_id): print('  ref', ref)
+            for entity in entities(pdb_id): print('  entity', entity)
+            for line in mentions(pdb_id): print('  mention', line)
+
+    elif command == 'accession':
+        for accession in args[2:]:
+            for pdb_id, chain in find_accession(accession): print(accession, pdb_id, chain)
+
+if __name__ == '__main__':
+    main()
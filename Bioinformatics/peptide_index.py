@@ -0,0 +1,78 @@
+# Substring containment index of peptide sequences (Aho-Corasick)
+# All sequences are put into one Aho-Corasick automaton. Running every sequence through it once gives all pairs
+# "u is contained in t" of the set in time linear in the total length plus the number of pairs, instead of testing
+# every pair with the in operator.
+#
+# index = ContainmentIndex(sequences)
+# index.contained(t)  : indexed sequences contained in t (t itself included if indexed)
+# index.containers(u) : indexed sequences that contain u (u itself included)
+# Frederik Friis Theisen 2024, University of Copenhagen
+
+from collections import deque
+
+class ContainmentIndex:
+
+    def __init__(self, sequences):
+        self.sequences = list(dict.fromkeys(sequences))
+        self.build()
+
+        # Containment relations of all indexed sequences, in both directions
+        self.inside = {t: self.search(t) for t in self.sequences}
+        self.outside = {u: set() for u in self.sequences}
+        for t, found in self.inside.items():
+            for u in found:
+                self.outside[u].add(t)
+
+    def build(self):
+        # Trie of the sequences with failure links and links to the nearest state that ends a sequence
+        self.goto = [{}]
+        self.terminal = [None] # Sequence ending in each state
+        for sequence in self.sequences:
+            state = 0
+            for c in sequence:
+                if c not in self.goto[state]:
+                    self.goto[state][c] = len(self.goto)
+                    self.goto.append({})
+                    self.terminal.append(None)
+                state = self.goto[state][c]
+            self.terminal[state] = sequence
+
+        self.fail = [0] * len(self.goto)
+        self.output = [None] * len(self.goto) # Nearest proper suffix state ending a sequence
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for c, child in self.goto[state].items():
+                queue.append(child)
+                f = self.fail[state]
+                while f and c not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[child] = self.goto[f][c] if c in self.goto[f] and self.goto[f][c] != child else 0
+                target = self.fail[child]
+                self.output[child] = target if self.terminal[target] is not None else self.output[target]
+
+    def search(self, text):
+        # Indexed sequences occurring in text
+        found = set()
+        if self.terminal[0] is not None: found.add('') # Empty sequence is in every text
+        reported = set() # States whose output chain was already reported
+        state = 0
+        for c in text:
+            while state and c not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(c, 0)
+
+            s = state
+            while s and s not in reported:
+                reported.add(s)
+                if self.terminal[s] is not None: found.add(self.terminal[s])
+                s = self.output[s]
+        return found
+
+    def contained(self, t):
+        if t in self.inside: return self.inside[t]
+        return self.search(t)
+
+    def containers(self, u):
+        if u in self.outside: return self.outside[u]
+        return set([t for t in self.sequences if u in t])
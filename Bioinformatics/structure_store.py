@@ -0,0 +1,193 @@
+# Local content-addressed store of PDB structures (gzip compressed mmCIF)
+# Structures are stored once per content as <root>/objects/<hash[:2]>/<hash>.cif.gz, and <root>/refs/<pdb id> holds the
+# hash of the current structure of an entry. The analyses read structures from the store, so reruns do no network I/O.
+# Missing entries are downloaded from RCSB as a fallback unless fetching is disabled (PDB_STORE_FETCH=0).
+#
+# Usage:
+# python3 structure_store.py prefetch <pdb ids or files with comma separated pdb ids>
+# python3 structure_store.py import <.cif/.cif.gz files or directories>
+# python3 structure_store.py path <pdb id>
+# python3 structure_store.py stats
+#
+# The store root is $PDB_STORE (default ~/pdb_store).
+# Frederik Friis Theisen 2024, University of Copenhagen
+
+import gzip
+import hashlib
+import os
+import re
+import shutil
+import sys
+import tempfile
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.environ.get('PDB_STORE', os.path.expanduser('~/pdb_store'))
+FETCH = os.environ.get('PDB_STORE_FETCH', '1') != '0'
+FETCH_URL = 'https://files.rcsb.org/download/{}.cif.gz'
+FETCH_THREADS = 8
+STATS = {'hit': 0, 'miss': 0, 'fetched': 0, 'failed': 0}
+
+def normalize_id(pdb_id):
+    return pdb_id.strip().lower()
+
+def ref_path(pdb_id):
+    return os.path.join(ROOT, 'refs', normalize_id(pdb_id))
+
+def object_path(digest):
+    return os.path.join(ROOT, 'objects', digest[:2], digest + '.cif.gz')
+
+def write_atomic(path, data, mode = 'wb'):
+    # Write to a temporary file and rename, so concurrent readers never see partial files
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    fd, tmp = tempfile.mkstemp(dir = os.path.dirname(path))
+    with os.fdopen(fd, mode) as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def add(pdb_id, content):
+    # Store uncompressed mmCIF content (bytes) for an entry, returns the object path
+    digest = hashlib.sha256(content).hexdigest()
+    path = object_path(digest)
+    if not os.path.exists(path):
+        write_atomic(path, gzip.compress(content, mtime = 0))
+    write_atomic(ref_path(pdb_id), digest, 'w')
+    return path
+
+def import_file(path, pdb_id = None):
+    # Add a local .cif or .cif.gz file, the entry id is taken from the file name if not given
+    if pdb_id is None: pdb_id = os.path.basename(path).split('.')[0]
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        return add(pdb_id, f.read())
+
+def lookup(pdb_id):
+    # Object path of an entry, or None if it is not in the store
+    try:
+        with open(ref_path(pdb_id)) as f:
+            path = object_path(f.read().strip())
+    except FileNotFoundError:
+        return None
+    return path if os.path.exists(path) else None
+
+def download(pdb_id):
+    url = FETCH_URL.format(normalize_id(pdb_id).upper())
+    with urllib.request.urlopen(url, timeout = 60) as response:
+        return add(pdb_id, gzip.decompress(response.read()))
+
+def get(pdb_id, fetch = None):
+    # Path of the gzip compressed mmCIF of an entry, downloaded if missing and fetching is enabled
+    path = lookup(pdb_id)
+    if path is not None:
+        STATS['hit'] += 1
+        return path
+
+    STATS['miss'] += 1
+    if fetch is None: fetch = FETCH
+    if not fetch: raise FileNotFoundError(f'{pdb_id} is not in the structure store ({ROOT}) and fetching is disabled')
+
+    try:
+        path = download(pdb_id)
+    except Exception:
+        STATS['failed'] += 1
+        raise
+    STATS['fetched'] += 1
+    return path
+
+def open_structure(pdb_id, fetch = None):
+    # Text file object of the mmCIF of an entry
+    return gzip.open(get(pdb_id, fetch), 'rt')
+
+def export(pdb_id, directory = '.', fetch = None):
+    # Uncompressed ./<id>.cif for tools that need a plain file, returns the path
+    path = os.path.join(directory, normalize_id(pdb_id) + '.cif')
+    with gzip.open(get(pdb_id, fetch), 'rb') as source, open(path, 'wb') as target:
+        shutil.copyfileobj(source, target)
+    return path
+
+def load(cmd, pdb_id, fetch = None):
+    # Replacement for cmd.fetch(pdb_id) in PyMOL: loads the entry from the store as object pdb_id
+    cmd.load(get(pdb_id, fetch), pdb_id.strip(), format = 'cif')
+
+def prefetch(pdb_ids, fetch = None, threads = FETCH_THREADS):
+    # Make sure all entries are in the store, missing entries are downloaded in parallel. Returns the failed ids
+    pdb_ids = list(dict.fromkeys([normalize_id(pdb_id) for pdb_id in pdb_ids if pdb_id.strip() != '']))
+    missing = [pdb_id for pdb_id in pdb_ids if lookup(pdb_id) is None]
+    STATS['hit'] += len(pdb_ids) - len(missing)
+    STATS['miss'] += len(missing)
+
+    if fetch is None: fetch = FETCH
+    if len(missing) == 0 or not fetch: return missing
+
+    def fetch_one(pdb_id):
+        try:
+            download(pdb_id)
+            return None
+        except Exception as e:
+            print(f'{pdb_id}: fetch failed ({e})')
+            return pdb_id
+
+    with ThreadPoolExecutor(threads) as executor:
+        failed = [pdb_id for pdb_id in executor.map(fetch_one, missing) if pdb_id is not None]
+
+    STATS['fetched'] += len(missing) - len(failed)
+    STATS['failed'] += len(failed)
+    return failed
+
+def format_stats():
+    total = STATS['hit'] + STATS['miss']
+    rate = 100 * STATS['hit'] / total if total > 0 else 0
+    return f"Structure store {ROOT}: {STATS['hit']} hits, {STATS['miss']} misses ({rate:.1f}% hit rate), {STATS['fetched']} fetched, {STATS['failed']} failed"
+
+def read_id_arguments(arguments):
+    # PDB ids given directly or as files with comma (or whitespace) separated ids
+    ids = []
+    for argument in arguments:
+        if os.path.isfile(argument):
+            with open(argument) as f:
+                ids.extend(re.split(r'[,\s]+', f.read()))
+        else: ids.append(argument)
+    return [pdb_id for pdb_id in ids if pdb_id.strip() != '']
+
+def main():
+    args = sys.argv
+    if len(args) < 2:
+        print('Usage: python3 structure_store.py prefetch|import|path|stats <arguments>')
+        return
+
+    command = args[1]
+
+    if command == 'prefetch':
+        ids = read_id_arguments(args[2:])
+        failed = prefetch(ids)
+        print(f'{len(ids)} entries, {len(failed)} not available')
+
+    elif command == 'import':
+        count = 0
+        for argument in args[2:]:
+            paths = [argument]
+            if os.path.isdir(argument): paths = [os.path.join(argument, fn) for fn in sorted(os.listdir(argument))]
+            for path in paths:
+                if path.endswith('.cif') or path.endswith('.cif.gz'):
+                    import_file(path)
+                    count += 1
+        print(f'Imported {count} files')
+
+    elif command == 'path':
+        for pdb_id in args[2:]:
+            print(get(pdb_id))
+
+    elif command == 'stats':
+        refs = os.listdir(os.path.join(ROOT, 'refs')) if os.path.isdir(os.path.join(ROOT, 'refs')) else []
+        objects = 0
+        size = 0
+        for directory, _, files in os.walk(os.path.join(ROOT, 'objects')):
+            objects += len(files)
+            size += sum([os.path.getsize(os.path.join(directory, fn)) for fn in files])
+        print(f'Structure store {ROOT}: {len(refs)} entries, {objects} objects, {size / 1e6:.1f} MB')
+        return
+
+    print(format_stats())
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,9 @@ from scipy.optimize import leastsq
 from COPASI import *
 import matplotlib.pyplot as plt
 import datetime
+import sys
+import os
+from concurrent.futures import ThreadPoolExecutor
 
 # Load the model once, assuming the path to your COPASI model file
 MODEL = "ITC_DataSimulation_pT391pS_mdl2"
@@ -27,6 +30,18 @@ k_cis_trans_initial = 0.0004*9
 K_re_initial = 0
 Offset_initial = 1000
 
+# Joint fit of ITC and NMR isomerization kinetics with shared K_cis_trans and k_cis_trans (run with -joint)
+JOINT_FIT = '-joint' in sys.argv
+NMR_DATASET = 'pT391pS'
+NMR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'NMR')
+WEIGHT_ITC = 1.0 # Relative block weights, each block is normalized by its RMSD at the initial guess
+WEIGHT_NMR = 1.0
+NMR_DATA = None
+BLOCK_SCALE = [1.0, 1.0]
+
+if '-witc' in sys.argv: WEIGHT_ITC = float(sys.argv[sys.argv.index('-witc') + 1])
+if '-wnmr' in sys.argv: WEIGHT_NMR = float(sys.argv[sys.argv.index('-wnmr') + 1])
+
 def read_data(rows):
     global N_INJ
     # Initialize a list to hold the dictionaries
@@ -238,7 +253,40 @@ def error_function(params):
     print(error)
     return error
 
-def find_allowed_deviation(best_fit_params, actual_data, percent_increase_allowed=5):
+def nmr_rmsd(K, k):
+    """
+    RMSD of the NMR cis/trans time series for the isomerization constants of the ITC model.
+    K_cis_trans = [cis]/[trans] at equilibrium and k_cis_trans is the cis -> trans rate, so the
+    exchange rate is k * (1 + K). The equilibrium level and amplitude are linear and solved directly.
+    """
+    t = NMR_DATA['time']
+    n = len(t)
+    decay = np.exp(-k * (1 + K) * t)
+
+    A = np.zeros((2*n, 2))
+    A[:n,0] = 1
+    A[n:,0] = 1 / K
+    A[:n,1] = decay
+    A[n:,1] = -decay
+    y = np.concatenate([NMR_DATA['cis'], NMR_DATA['trans']])
+
+    coef, _, _, _ = np.linalg.lstsq(A, y, rcond=None)
+
+    return np.sqrt(np.mean((y - A @ coef) ** 2))
+
+def joint_blocks(params):
+    # ITC simulation and NMR kinetics residuals are evaluated concurrently
+    itc = EXECUTOR.submit(lambda: compute_rmsd(sample_parameters(*params), DATA))
+    nmr = EXECUTOR.submit(nmr_rmsd, params[5], params[6])
+    return itc.result(), nmr.result()
+
+def joint_error_function(params):
+    itc, nmr = joint_blocks(params)
+    error = np.sqrt(WEIGHT_ITC * (itc / BLOCK_SCALE[0]) ** 2 + WEIGHT_NMR * (nmr / BLOCK_SCALE[1]) ** 2)
+    print(error, itc, nmr)
+    return error
+
+def find_allowed_deviation(best_fit_params, actual_data, percent_increase_allowed=5, objective=None):
     """
     Finds the allowed deviation for each parameter that results in an RMSD 
     up to a specified percent higher than the best fit RMSD.
@@ -248,10 +296,15 @@ def find_allowed_deviation(best_fit_params, actual_data, percent_increase_allowe
     - actual_data: The actual data to compare against the simulation.
     - percent_increase_allowed: The allowed increase in RMSD, in percent.
 
+    - objective: Optional function of the parameters used instead of the ITC RMSD (joint fit).
+
     Returns:
     - A dictionary with parameter indices as keys and (min_deviation, max_deviation) as values.
     """
-    initial_rmsd = compute_rmsd(sample_parameters(*best_fit_params), actual_data)
+    if objective is None:
+        objective = lambda params: compute_rmsd(sample_parameters(*params), actual_data)
+
+    initial_rmsd = objective(best_fit_params)
     allowed_rmsd = initial_rmsd * (1 + percent_increase_allowed / 100)
     
     deviations = []
@@ -271,7 +324,7 @@ def find_allowed_deviation(best_fit_params, actual_data, percent_increase_allowe
             new_param += step_size
             new_params = best_fit_params.copy()
             new_params[i] = new_param
-            new_rmsd = compute_rmsd(sample_parameters(*new_params), actual_data)
+            new_rmsd = objective(new_params)
             if new_rmsd > allowed_rmsd:
                 break
             max_deviation = new_param - param
@@ -291,7 +344,7 @@ def find_allowed_deviation(best_fit_params, actual_data, percent_increase_allowe
             new_param -= step_size
             new_params = best_fit_params.copy()
             new_params[i] = new_param
-            new_rmsd = compute_rmsd(sample_parameters(*new_params), actual_data)
+            new_rmsd = objective(new_params)
             if new_rmsd > allowed_rmsd:
                 break
             min_deviation = new_param - param
@@ -321,6 +374,17 @@ with open(f'{DATAFILE}.csv') as f:
     for inj in dat:
         DATA.append([inj['ratio'],inj['avg_itc_peak'],inj['include']])
 
+if JOINT_FIT:
+    # Isomerization constants start from the NMR kinetics fit and are free in the joint fit
+    sys.path.append(NMR_PATH)
+    import CisTransKinetics
+
+    NMR_DATA = CisTransKinetics.LoadDataset(NMR_DATASET)
+    nmr_fit = CisTransKinetics.FitDataset(NMR_DATASET, resamples=0)
+    K_cis_trans_initial = 1 / nmr_fit['K'][0]
+    k_cis_trans_initial = nmr_fit['k_ct'][0]
+    EXECUTOR = ThreadPoolExecutor(max_workers=2)
+
 # Initial guesses for parameters
 initial_guess = [dg_cis_initial, Hcis_initial, Htrans_initial, R_initial, N_initial, K_cis_trans_initial, k_cis_trans_initial, Offset_initial]
 
@@ -334,10 +398,20 @@ bounds = [
           (k_cis_trans_initial/100,k_cis_trans_initial*100),
           (-30000,30000)]
 
+objective = error_function
+deviation_objective = None
+
+if JOINT_FIT:
+    bounds[5] = (K_cis_trans_initial/10, K_cis_trans_initial*10)
+    BLOCK_SCALE = list(joint_blocks(initial_guess))
+    objective = joint_error_function
+    deviation_objective = joint_error_function
+    print(f"JOINT FIT: ITC weight {WEIGHT_ITC}, NMR weight {WEIGHT_NMR}, block scales {BLOCK_SCALE}")
+
 # Perform the optimization to fit the model parameters
-result = minimize(error_function, initial_guess, method='Nelder-Mead', bounds=bounds, options={'adaptive':True, 'fatol': 0.1})
+result = minimize(objective, initial_guess, method='Nelder-Mead', bounds=bounds, options={'adaptive':True, 'fatol': 0.1})
 
-result = minimize(error_function, result.x, method='Nelder-Mead', bounds=bounds, options={'adaptive':False})
+result = minimize(objective, result.x, method='Nelder-Mead', bounds=bounds, options={'adaptive':False})
 
 # Extract the fitted parameters
 fitted_params = result.x
@@ -346,7 +420,7 @@ print(fitted_params)
 print()
 print("Getting errors...")
 
-deviations = find_allowed_deviation(fitted_params, DATA)
+deviations = find_allowed_deviation(fitted_params, DATA, objective=deviation_objective)
 
 print()
 print(f"OUTPUT: {DATAFILE}")
@@ -358,6 +432,7 @@ print(f'N = [{fitted_params[4]},{deviations[4]}]')
 print(f'R = [{fitted_params[3]},{deviations[3]}]')
 print(f'K_cis_trans = [{fitted_params[5]},{deviations[5]}]')
 print(f'- k_cis_trans = [{fitted_params[6]},{deviations[6]}]')
+if JOINT_FIT: print(f'RMSD ITC, NMR = {joint_blocks(fitted_params)}')
 
 print()
 
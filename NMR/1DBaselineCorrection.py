@@ -13,8 +13,17 @@ Features:
 - Baseline correction with customizable polynomial degree.
 - Manual peak picking with options for consistent peak width and region mode.
 - Reference mode adjustment for peak alignment across spectra (does not work well).
+- Automatic referencing of all rows to a reference row by FFT cross-correlation (-refmode auto).
 - Support for processing individual files or entire directories.
 - Exports baseline-corrected spectra and peak volumes to text files.
+- Optional binary export (.npy/.npz) of baseline-corrected spectra for fast, memory-mappable loading.
+- Peak volumes from a cumulative sum table (box sum or trapezoidal integration in ppm units).
+- Automatic baseline point detection (noise/derivative classifier) and a headless mode for unattended processing.
+- Region mode (-region) that only reads and keeps a ppm window of the spectra.
+- Per-stage wall time report (-profile), peak memory in a separate traced run (-profilememory).
+- Smoothing spline, piecewise linear and rolling minimum baseline models (-bslmodel), fitted on all rows at once.
+- Line shape fitting of overlapping peaks with shared positions and widths across rows (-quant fit).
+- Saved processing setup (-setup) and watch mode (-watch) that processes new experiments of a running acquisition.
 
 Usage:
 Run the script with the path to the data file or directory as the first argument. Additional options for peak width, mode, 
@@ -26,10 +35,19 @@ Repository: https://github.com/FrederikTheisen/FTNMRTools
 
 import sys
 import numpy as np
+import matplotlib
+if '-headless' in sys.argv: matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 from matplotlib.widgets import Button
 import matplotlib.cm as cm
 import os
+import re
+import itertools
+import time
+import tracemalloc
+import functools
+import atexit
+import json
 
 args = sys.argv
 
@@ -46,7 +64,25 @@ if '-help' in args or '-h' in args:
 	print("Options:")
 	print("-mode X	  :	set mode, X = 0 (width mode [default]), 1 (region mode)")
 	print("-width X	  :	set peak width, X is float")
-	print("-refmode	X :	set reference mode, X = 'min' or 'max' [default]")
+	print("-refmode	X :	set reference mode, X = 'min', 'max' [default] or 'auto' (cross-correlation)")
+	print("-refwindow X :	set half width of auto reference window in ppm, X is float [default 0.1]")
+	print("-refrow X  :	set row used as reference in auto reference mode [default first row]")
+	print("-format X  :	set baseline corrected output format, X = 'txt' [default], 'npy' or 'npz'")
+	print("-integration X :	set peak integration, X = 'sum' (sum of points [default]) or 'trapz' (trapezoidal, ppm units)")
+	print("-autobsl X :	detect baseline points automatically, X = 'sum' (once on summed spectrum) or 'row' (per row)")
+	print("-headless  :	run without GUI, baseline points are detected automatically and peaks are given by -peaks")
+	print("-peaks X.. :	peak boundaries in ppm (start end start end ...), or peak centers if a peak width is set in width mode")
+	print("-memmap    :	keep folder data in a memory mapped file (<name>_ingest.npy) instead of memory")
+	print("-region X Y :	only load the ppm window from X to Y")
+	print("-profile   :	report wall time of each processing stage at exit (<name>_profile.txt)")
+	print("-profilememory :	also report peak memory of each stage, traced with tracemalloc (slows the run, times are not representative)")
+	print("-bslmodel X :	set baseline model, X = 'poly' [default], 'spline' (smoothing spline), 'linear' (between points) or 'rolling' (rolling minimum)")
+	print("-smooth X  :	set smoothing of the spline baseline model, X is float [default 1e-4]")
+	print("-bslwindow X :	set window of the rolling baseline model in ppm, X is float [default 0.5]")
+	print("-quant X   :	set peak quantification, X = 'box' (integrate peak regions [default]) or 'fit' (line shape fit, peak areas)")
+	print("-lineshape X :	set line shape of the fit, X = 'lorentz' [default] or 'voigt' (pseudo-Voigt)")
+	print("-setup X   :	apply baseline and peak setup from file X (<name>_setup.json, written by every run) without GUI")
+	print("-watch X   :	keep watching the folder for new experiments and append their integrals to <name>_integrals.txt, X is poll interval in s [default 10]")
 	exit()
 
 PATH = args[1]
@@ -67,6 +103,39 @@ ARG_PEAK_WIDTH = None
 REF_MODE = 'max'
 IS_REFERENCING = False
 OFFSET = {}
+PLOT = {}
+REF_WINDOW = 0.1
+REF_ROW = None
+HEADLESS = '-headless' in args
+AUTO_BASELINE = None
+AUTO_BSL_POINTS = 64 # Number of baseline points picked from the detected baseline regions
+AUTO_BSL_NOISE = 3.0 # Signal threshold in units of the noise level
+AUTO_BSL_MARGIN = 0.02 # ppm excluded around detected signals
+ARG_PEAKS = []
+FOLDER_FILE_PATTERN = r'(\d+)\.txt' # Files written by the multitotxt AU program
+CHUNK_LINES = 65536
+LOW_MEMORY = '-memmap' in args
+REGION = None
+PROFILE_MEMORY = '-profilememory' in args # tracemalloc slows Python heavy stages a lot, so it is not part of -profile
+PROFILE = '-profile' in args or PROFILE_MEMORY
+PROFILE_STATS = {}
+PROFILE_STACK = []
+OUTPUT_FORMAT = 'txt'
+INTEGRATION_MODE = 'sum'
+BASELINE_MODELS = ['poly', 'spline', 'linear', 'rolling']
+BASELINE_MODEL = 'poly'
+SMOOTHING = 1e-4 # Smoothing spline penalty, baseline point positions scaled to 0-1
+BSL_WINDOW = 0.5 # ppm, rolling baseline model
+QUANT_MODE = 'box'
+LINE_SHAPE = 'lorentz'
+FIT_MARGIN = 0.5 # Fit window extends the peak regions by this fraction of their width on both sides
+FIT_ITERATIONS = 100
+LINE_FITS = [] # Fitted (center, hwhm, eta) of each peak
+SETUP = None
+BASELINE_POSITIONS = [] # Baseline point positions applied to new experiments
+WATCH = '-watch' in args
+WATCH_INTERVAL = 10 # s
+FOLDER_AXIS = {} # Spectral window of the folder data, used to read new experiments onto the same axis
 
 if '-pw' in args:
 	idx = args.index('-pw')
@@ -86,46 +155,249 @@ if '-refmode' in args:
 	idx = args.index('-refmode')
 	REF_MODE = args[idx + 1]
 
+if '-refwindow' in args:
+	idx = args.index('-refwindow')
+	REF_WINDOW = float(args[idx + 1])
+
+if '-refrow' in args:
+	idx = args.index('-refrow')
+	REF_ROW = int(args[idx + 1])
+
+if '-autobsl' in args:
+	idx = args.index('-autobsl')
+	AUTO_BASELINE = args[idx + 1]
+elif HEADLESS:
+	AUTO_BASELINE = 'sum'
+
+if '-region' in args:
+	idx = args.index('-region')
+	REGION = [float(args[idx + 1]), float(args[idx + 2])]
+
+if '-bslmodel' in args:
+	idx = args.index('-bslmodel')
+	BASELINE_MODEL = args[idx + 1]
+
+if '-smooth' in args:
+	idx = args.index('-smooth')
+	SMOOTHING = float(args[idx + 1])
+
+if '-bslwindow' in args:
+	idx = args.index('-bslwindow')
+	BSL_WINDOW = float(args[idx + 1])
+
+if '-quant' in args:
+	idx = args.index('-quant')
+	QUANT_MODE = args[idx + 1]
+
+if '-lineshape' in args:
+	idx = args.index('-lineshape')
+	LINE_SHAPE = args[idx + 1]
+
+if '-setup' in args:
+	idx = args.index('-setup')
+	SETUP = args[idx + 1]
+
+if WATCH:
+	idx = args.index('-watch')
+	try: WATCH_INTERVAL = float(args[idx + 1])
+	except (IndexError, ValueError): pass
+
+if '-peaks' in args:
+	idx = args.index('-peaks') + 1
+	while idx < len(args):
+		try: ARG_PEAKS.append(float(args[idx]))
+		except ValueError: break
+		idx += 1
+
+if '-format' in args:
+	idx = args.index('-format')
+	OUTPUT_FORMAT = args[idx + 1]
+
+if '-integration' in args:
+	idx = args.index('-integration')
+	INTEGRATION_MODE = args[idx + 1]
+
+def Profiled(function):
+	# Record wall time (and with -profilememory peak memory) of a processing stage when profiling is enabled
+	if not PROFILE: return function
+
+	@functools.wraps(function)
+	def wrapper(*fargs, **fkwargs):
+		if PROFILE_MEMORY:
+			current, peak = tracemalloc.get_traced_memory()
+			for frame in PROFILE_STACK: frame['peak'] = max(frame['peak'], peak) # Keep peak of enclosing stages
+			tracemalloc.reset_peak()
+			PROFILE_STACK.append({'start': current, 'peak': current})
+		start = time.perf_counter()
+		try:
+			return function(*fargs, **fkwargs)
+		finally:
+			elapsed = time.perf_counter() - start
+			stats = PROFILE_STATS.setdefault(function.__name__, {'calls': 0, 'time': 0.0, 'memory': np.nan})
+			stats['calls'] += 1
+			stats['time'] += elapsed
+			if PROFILE_MEMORY:
+				_, peak = tracemalloc.get_traced_memory()
+				frame = PROFILE_STACK.pop()
+				for f in PROFILE_STACK: f['peak'] = max(f['peak'], peak)
+				stats['memory'] = np.nanmax([stats['memory'], max(frame['peak'], peak) - frame['start']])
+
+	return wrapper
+
+def PrintProfile():
+	lines = [f"{'stage':<20} {'calls':>6} {'time_s':>10} {'mean_s':>10} {'peak_MB':>10}"]
+	for stage in PROFILE_STATS:
+		stats = PROFILE_STATS[stage]
+		lines.append(f"{stage:<20} {stats['calls']:>6} {stats['time']:>10.4f} {stats['time'] / stats['calls']:>10.4f} {stats['memory'] / 1e6:>10.2f}")
+
+	print()
+	print("PROFILE")
+	print("\n".join(lines))
+
+	with open(FILENAME + "_profile.txt","w+") as f:
+		f.write("\n".join(lines) + "\n")
+
+if PROFILE:
+	if PROFILE_MEMORY: tracemalloc.start()
+	atexit.register(PrintProfile)
+
 def IdentifyInputData():
 	if os.path.isdir(PATH): return 'dir'
 	else: return 'file'
 
+def ReadHeader(path):
+	# Read only the header of a totxt export
+	header = {'left': None, 'right': None, 'size': None}
+	with open(path) as f:
+		for line in f:
+			if '#' not in line: break
+			if '# LEFT' in line or '# F2LEFT' in line: #Get ppm range
+				dat = line.split()
+				header['left'] = float(dat[3])
+				header['right'] = float(dat[7])
+			if '# SIZE' in line or '# NCOLS' in line: #Get number of data points
+				dat = line.split()
+				header['size'] = int(dat[3])
+	return header
+
+def RegionIndices(left, right, size):
+	# Index range [i0, i1) of the points of an axis from left to right that are inside REGION
+	axis = np.linspace(left, right, size)
+	i0 = int(np.searchsorted(-axis, -max(REGION), side = 'left'))
+	i1 = int(np.searchsorted(-axis, -min(REGION), side = 'right'))
+	return i0, i1
+
+def StreamSpectrum(path, header, out, grid = None, start = 0, stop = None):
+	# Stream the values [start, stop) of a totxt export into out, chunk by chunk. Values before start are skipped
+	# without parsing and reading stops at stop. If grid is given the spectrum is linearly resampled from its own
+	# axis onto the grid, otherwise the values are copied (and truncated)
+	axis = np.linspace(header['left'], header['right'], header['size'])
+	position = start # Index of next value in file
+	written = 0 # Index of next value in out
+	last = None # Last point of previous chunk, [ppm, value]
+
+	with open(path) as f:
+		lines = itertools.islice((line for line in f if '#' not in line), start, stop)
+		while True:
+			chunk = list(itertools.islice(lines, CHUNK_LINES))
+			if len(chunk) == 0: break
+			values = np.array(chunk, dtype = float)
+
+			if grid is None:
+				n = min(len(values), len(out) - written)
+				out[written:written + n] = values[0:n]
+				written += n
+			else:
+				x = axis[position:position + len(values)]
+				values = values[0:len(x)]
+				if last is not None:
+					x = np.concatenate([[last[0]], x])
+					values = np.concatenate([[last[1]], values])
+				if len(x) == 0: break
+
+				i0 = np.searchsorted(-grid, -x[0], side = 'left')
+				i1 = np.searchsorted(-grid, -x[-1], side = 'right')
+				out[i0:i1] = np.interp(-grid[i0:i1], -x, values)
+				last = [x[-1], values[-1]]
+
+			position += len(chunk)
+
+def AllocateMatrix(rows, points):
+	# Disk backed array for experiments that do not fit in memory
+	if LOW_MEMORY:
+		print(f"Allocating memory mapped array: {FILENAME}_ingest.npy")
+		return np.lib.format.open_memmap(FILENAME + "_ingest.npy", mode = 'w+', dtype = float, shape = (rows, points))
+	return np.zeros((rows, points))
+
+def ListFolderFiles(verbose = True):
+	# multitotxt writes one <expno>.txt file per experiment
+	files = {}
+	for fn in sorted(os.listdir(PATH)):
+		match = re.fullmatch(FOLDER_FILE_PATTERN, fn)
+		if match is None or os.path.isdir(os.path.join(PATH, fn)):
+			if verbose: print("Skipping: " + fn)
+			continue
+		files[int(match.group(1))] = os.path.join(PATH, fn)
+	return files
+
+def ReadFolderSpectrum(path, header, out):
+	# Read one experiment onto the folder axis
+	# Truncate data sets with too many points (number of points are +- 1 for unknown reasons)
+	resample = FOLDER_AXIS['resample'] or not (np.isclose(header['left'], FOLDER_AXIS['left']) and np.isclose(header['right'], FOLDER_AXIS['right']))
+
+	if not resample:
+		StreamSpectrum(path, header, out, None, FOLDER_AXIS['start'], FOLDER_AXIS['stop'])
+	elif REGION is not None: # One extra point on each side for interpolation
+		i0, i1 = RegionIndices(header['left'], header['right'], header['size'])
+		StreamSpectrum(path, header, out, XAXIS, max(i0 - 1, 0), i1 + 1)
+	else:
+		StreamSpectrum(path, header, out, XAXIS)
+
+@Profiled
 def ReadFolderData():
 	global colors
 	global XAXIS
 	global ppmrange
 	data = {}
-	point = None
-	minpoints = 9999999999
 
 	print("READING FOLDER DATA...")
 
-	files = [f for f in os.listdir(PATH) if not os.path.isdir(f) and 'Icon' not in f]
-
-	for fn in files:
-		path = PATH + "/" + fn
-		spectrum = []
-		with open(path) as f:
-			for line in f:
-				if '#' in line:
-					if '# LEFT' in line: #Get ppm range
-						dat = line.split()
-						ppmrange = [float(dat[3]),float(dat[7])]
-					if '# SIZE' in line: #Get number of data points
-						dat = line.split()
-						points = int(dat[3])
-						if points < minpoints: minpoints = points
-				else: #get data point value
-					value = float(line)
-					
-					spectrum.append(value)
-		data[int(fn.split('.')[0])] = spectrum
+	files = ListFolderFiles()
+	expnos = sorted(files.keys())
+	headers = {expno: ReadHeader(files[expno]) for expno in expnos}
+	for expno in expnos:
+		if None in headers[expno].values(): print(f"Invalid header: {files[expno]}")
+	expnos = [expno for expno in expnos if None not in headers[expno].values()]
+
+	# Agree on a common axis
+	lefts = np.array([headers[expno]['left'] for expno in expnos])
+	rights = np.array([headers[expno]['right'] for expno in expnos])
+	minpoints = min([headers[expno]['size'] for expno in expnos])
+	resample = not (np.allclose(lefts, lefts[0]) and np.allclose(rights, rights[0]))
+
+	if resample: # Different spectral windows, resample onto the overlapping ppm range
+		ppmrange = [lefts.min(), rights.max()]
+		print(f"Spectral windows differ, resampling onto {ppmrange[0]} to {ppmrange[1]} ppm")
+	else:
+		ppmrange = [lefts[0], rights[0]]
 
-	XAXIS = list(np.linspace(ppmrange[0],ppmrange[1],minpoints))
+	XAXIS = np.linspace(ppmrange[0],ppmrange[1],minpoints)
+	start, stop = 0, minpoints
 
-	# Truncate data sets with too many points (number of points are +- 1 for unknown reasons)
-	for d in data:
-		data[d] = data[d][0:minpoints]
+	if REGION is not None: # Only keep the region, the range of each file is computed from its header
+		start, stop = RegionIndices(ppmrange[0], ppmrange[1], minpoints)
+		XAXIS = XAXIS[start:stop]
+		ppmrange = [XAXIS[0], XAXIS[-1]]
+		print(f"Region: {ppmrange[0]} to {ppmrange[1]} ppm, {len(XAXIS)} points")
+
+	FOLDER_AXIS.update({'left': lefts[0], 'right': rights[0], 'start': start, 'stop': stop, 'resample': resample})
+	matrix = AllocateMatrix(len(expnos), len(XAXIS))
+
+	for i, expno in enumerate(expnos):
+		ReadFolderSpectrum(files[expno], headers[expno], matrix[i])
+		data[expno] = matrix[i]
+		print(f"\rRead {i + 1}/{len(expnos)}: {os.path.basename(files[expno])}", end = '')
+	print()
 
 	# Get the 'viridis' colormap
 	cmap = cm.get_cmap('viridis')
@@ -142,14 +414,17 @@ def ReadFolderData():
 		colors[k] = colorlist[i]
 		i += 1
 
-	return data, minpoints
+	return data, len(XAXIS)
 
+@Profiled
 def ReadData():
 	global colors
 	global XAXIS
 	global ppmrange
 	data = {}
 	points = None
+	start, stop = 0, None
+	index = 0
 
 	print("READING DATA...")
 
@@ -162,16 +437,26 @@ def ReadData():
 			if '# NCOLS' in line or '# SIZE' in line:
 				dat = line.split()
 				points = int(dat[3])
+				if REGION is not None: start, stop = RegionIndices(ppmrange[0], ppmrange[1], points)
 			if "# row" in line: #Register new row
 				dat = line.split()
 				rowid = int(dat[-1])
 				data[rowid] = []
+				index = 0
 			elif "#" not in line: #register data
 				if rowid not in data: data[rowid] = []
-				value = float(line)
-				data[rowid].append(value)
+				if index >= start and (stop is None or index < stop): # Points outside region are not parsed
+					value = float(line)
+					data[rowid].append(value)
+				index += 1
 
-	XAXIS = list(np.linspace(ppmrange[0],ppmrange[1],points))
+	XAXIS = np.linspace(ppmrange[0],ppmrange[1],points)
+
+	if REGION is not None:
+		XAXIS = XAXIS[start:stop]
+		points = len(XAXIS)
+		ppmrange = [XAXIS[0], XAXIS[-1]]
+		print(f"Region: {ppmrange[0]} to {ppmrange[1]} ppm, {points} points")
 
 	# Get the 'viridis' colormap
 	cmap = cm.get_cmap('viridis')
@@ -212,6 +497,10 @@ def BaselineCorrect(data):
 	button_ax = plt.axes([btn_margin,0,btn_width,.1])
 	polyminus_btn = Button(button_ax, 'Pol Degree -1', color='lightgoldenrodyellow', hovercolor='0.975')
 	polyminus_btn.on_clicked(lambda event: onpolydegreebtnclick(event, data, ax, -1))
+	# Add baseline model option
+	button_ax = plt.axes([btn_margin+2*btn_width,0,btn_width,.1])
+	model_btn = Button(button_ax, 'Model: ' + BASELINE_MODEL, color='lightgoldenrodyellow', hovercolor='0.975')
+	model_btn.on_clicked(lambda event: onbaselinemodelbtnclick(event, data, ax, model_btn))
 
 	# Add a 'Clear' button to the plot
 	button_ax = plt.axes([1-btn_margin-2*btn_width,0,btn_width,.1])
@@ -226,6 +515,7 @@ def BaselineCorrect(data):
 	cid = fig.canvas.mpl_connect('button_press_event', lambda event: onclick(event, data, ax))
 
 	Draw(data, ax, mode = 0)
+	plt.show()
 
 def PeakPicking(data):
 	global OFFSET
@@ -261,63 +551,136 @@ def PeakPicking(data):
 	cid = fig.canvas.mpl_connect('button_press_event', lambda event: onpeakpickingclick(event, data, ax))
 
 	Draw(data, ax, mode = 1)
+	plt.show()
 
 # Draw function
+@Profiled
 def Draw(data, ax, mode = 0):
+	# Spectra and baselines are persistent line artists, only their data is updated
+	if PLOT.get('ax') is not ax: SetupPlot(data, ax, mode)
+
+	PLOT['baselinematrix'] = None
+	if mode == 0 and len(Baselines) > 0:
+		# Rows without a baseline (too few baseline points) are NaN and not drawn
+		missing = np.full(len(XAXIS), np.nan)
+		PLOT['baselinematrix'] = np.array([Baselines.get(rowid, missing) for rowid in data])
+
+	UpdateLines(ax)
+	UpdateOverlay(ax, mode)
+
+	ax.figure.canvas.draw_idle()
+
+def SetupPlot(data, ax, mode):
+	PLOT.clear()
+	PLOT['ax'] = ax
+	PLOT['rowids'] = list(data.keys())
+	PLOT['matrix'] = np.array([data[rowid] for rowid in data], dtype = float)
+	PLOT['baselinematrix'] = None
+	PLOT['lines'] = [ax.plot([], [], color=colors[rowid])[0] for rowid in data]
+	PLOT['baselines'] = [ax.plot([], [], color=colors[rowid])[0] for rowid in data]
+	PLOT['overlay'] = []
+	PLOT['background'] = None
+	PLOT['blit'] = ax.figure.canvas.supports_blit
+
+	# Initial limits from the full data range
+	ax.set_xlim(XAXIS[0], XAXIS[-1]) # Inverted ppm axis
+	ax.set_ylim(PLOT['matrix'].min(), PLOT['matrix'].max())
+
+	ax.callbacks.connect('xlim_changed', lambda event_ax: UpdateLines(event_ax))
+	ax.figure.canvas.mpl_connect('draw_event', lambda event: ondrawevent(event, ax))
+
+def Decimate(matrix, xlim, pixels):
+	# Min/max decimation of all rows to at most two points per pixel within the x limits
+	maxoffset = max([abs(OFFSET[rowid]) for rowid in OFFSET], default = 0)
+	i0 = max(GetAxisIndexFromPosition(max(xlim) + maxoffset) - 1, 0)
+	i1 = min(GetAxisIndexFromPosition(min(xlim) - maxoffset) + 1, len(XAXIS))
+	n = i1 - i0
+
+	if n <= 2 * pixels: return XAXIS[i0:i1], matrix[:, i0:i1]
+
+	binsize = n // pixels
+	nbins = n // binsize
+	i2 = i0 + nbins * binsize
+
+	blocks = matrix[:, i0:i2].reshape(matrix.shape[0], nbins, binsize)
+	y = np.empty((matrix.shape[0], 2 * nbins))
+	y[:, 0::2] = blocks.min(axis = 2)
+	y[:, 1::2] = blocks.max(axis = 2)
+	x = np.repeat(XAXIS[i0:i2:binsize], 2)
+
+	# Remaining points are kept as is
+	return np.concatenate([x, XAXIS[i2:i1]]), np.concatenate([y, matrix[:, i2:i1]], axis = 1)
+
+def UpdateLines(ax):
+	pixels = max(int(ax.bbox.width), 1)
+	xlim = ax.get_xlim()
+
+	x, y = Decimate(PLOT['matrix'], xlim, pixels)
+	if PLOT['baselinematrix'] is not None:
+		_, bsl = Decimate(PLOT['baselinematrix'], xlim, pixels)
+
+	for i in range(len(PLOT['rowids'])):
+		rowid = PLOT['rowids'][i]
+		axis = x
+		if len(OFFSET) > 0: axis = x - OFFSET[rowid]
+
+		PLOT['lines'][i].set_data(axis, y[i])
+
+		if PLOT['baselinematrix'] is not None:
+			PLOT['baselines'][i].set_data(axis, bsl[i])
+			PLOT['baselines'][i].set_visible(True)
+		else:
+			PLOT['baselines'][i].set_visible(False)
 
-	old_x_lim = None
-
-	if ax.lines:
-		old_x_lim = ax.get_xlim()
-		old_y_lim = ax.get_ylim()
-
-	ax.clear()
-	for rowid in data:
-		graph = data[rowid]
-		axis = XAXIS
-
-		if len(OFFSET) > 0:
-			axis = [x - OFFSET[rowid] for x in axis]
+def UpdateOverlay(ax, mode):
+	# Markers are redrawn on their own (blitted) without redrawing the spectra
+	for artist in PLOT['overlay']: artist.remove()
+	PLOT['overlay'] = []
 
-		ax.plot(axis, graph, color=colors[rowid])
-		if mode == 0: #DRAW BASELINES
-			if len(Baselines) > 0:
-				ax.plot(axis, Baselines[rowid],color=colors[rowid]) 
-			
-			x = []
-			y = []
-			
+	if mode == 0: #DRAW BASELINE POINTS
+		x = []
+		y = []
+		c = []
+		for rowid in PLOT['rowids']:
 			for bp in BaselinePoints[rowid]:
 				x.append(bp[0])
 				y.append(bp[1])
-			
-			ax.scatter(x,y, color=colors[rowid])
+				c.append(colors[rowid])
+
+		if len(x) > 0: PLOT['overlay'].append(ax.scatter(x, y, color=c))
 
 	if mode == 1: #DRAW PEAK PICKING
-		if len(PEAKPOINTS) > 0:
-			print("Draw peaks")
-			peakrange = ax.get_ylim()
-			for peak in PEAKPOINTS:
-				print(peak)
-				ax.vlines(x = peak, ymin = old_y_lim[0], ymax = old_y_lim[1])
-
-			if len(PEAKPOINTS) > 1: 
-				for i in range(0,len(PEAKPOINTS) - 1,2):
-					print(i)
-					peakstart = PEAKPOINTS[i]
-					peakend = PEAKPOINTS[i+1]
-					ax.axvspan(peakstart, peakend, facecolor='b', alpha=0.2)
-
-
-	if old_x_lim is not None:
-		ax.set_xlim(old_x_lim)  # and restore zoom
-		ax.set_ylim(old_y_lim)
-	else:
-		ax.invert_xaxis()
+		for peak in PEAKPOINTS:
+			PLOT['overlay'].append(ax.axvline(x = peak, color = 'k'))
 
-	plt.draw()
-	plt.show()
-	plt.pause(0.0001)
+		for i in range(0,len(PEAKPOINTS) - 1,2):
+			peakstart = PEAKPOINTS[i]
+			peakend = PEAKPOINTS[i+1]
+			PLOT['overlay'].append(ax.axvspan(peakstart, peakend, facecolor='b', alpha=0.2))
+
+	for artist in PLOT['overlay']: artist.set_animated(PLOT['blit'])
+
+def BlitOverlay(ax):
+	canvas = ax.figure.canvas
+
+	if not PLOT['blit'] or PLOT['background'] is None:
+		canvas.draw_idle()
+		return
+
+	canvas.restore_region(PLOT['background'])
+	for artist in PLOT['overlay']: ax.draw_artist(artist)
+	canvas.blit(ax.bbox)
+
+def DrawOverlay(ax, mode):
+	UpdateOverlay(ax, mode)
+	BlitOverlay(ax)
+
+def ondrawevent(event, ax):
+	# Store the background after a full redraw and draw the animated markers on top
+	if not PLOT['blit'] or PLOT.get('ax') is not ax: return
+	PLOT['background'] = ax.figure.canvas.copy_from_bbox(ax.bbox)
+	for artist in PLOT['overlay']: ax.draw_artist(artist)
+	ax.figure.canvas.blit(ax.bbox)
 
 # Define a function to handle mouse clicks on the plot
 def onclick(event, data, ax): 
@@ -334,7 +697,7 @@ def onclick(event, data, ax):
 
 	    AddPointsAtPosition(x_pos,data)
 
-	    Baselines = FitBaselines()
+	    Baselines = FitBaselines(data)
 
 	    Draw(data, ax)
 
@@ -357,13 +720,35 @@ def onclearbuttonclick(event, data, ax):
 
 def onpolydegreebtnclick(event, data, ax, delta):
 	global polydegree
+	global SMOOTHING
+	global BSL_WINDOW
 	global Baselines
 
-	polydegree = polydegree + delta
-	if polydegree < 0: polydegree = 0
-	if polydegree > 20: polydegree = 20
+	# The +1/-1 buttons adjust the stiffness of the selected baseline model
+	if BASELINE_MODEL == 'spline':
+		SMOOTHING = SMOOTHING * 10**delta
+		print(f"Smoothing = {SMOOTHING}")
+	elif BASELINE_MODEL == 'rolling':
+		BSL_WINDOW = BSL_WINDOW * 2**delta
+		print(f"Baseline window = {BSL_WINDOW} ppm")
+	else:
+		polydegree = polydegree + delta
+		if polydegree < 0: polydegree = 0
+		if polydegree > 20: polydegree = 20
 
-	Baselines = FitBaselines()
+	Baselines = FitBaselines(data)
+
+	Draw(data, ax)
+
+def onbaselinemodelbtnclick(event, data, ax, model_btn):
+	global BASELINE_MODEL
+	global Baselines
+
+	BASELINE_MODEL = BASELINE_MODELS[(BASELINE_MODELS.index(BASELINE_MODEL) + 1) % len(BASELINE_MODELS)]
+	print("Baseline model: " + BASELINE_MODEL)
+	model_btn.label.set_text('Model: ' + BASELINE_MODEL)
+
+	Baselines = FitBaselines(data)
 
 	Draw(data, ax)
 
@@ -383,16 +768,16 @@ def onpeakpickingclick(event, data, ax):
 		if IS_REFERENCING:
 			ReferenceSpectra(x_pos, data)
 			IS_REFERENCING = False
+			Draw(data, ax, mode = 1)
 		else:
 			AddPeakRangePoint(x_pos,data)
-
-		Draw(data, ax, mode = 1)
+			DrawOverlay(ax, mode = 1)
 
 def onpeakpickingclearbtnclick(event, data, ax):
 	PEAKPOINTS.clear()
 	print(len(PEAKPOINTS))
 
-	Draw(data, ax, mode = 1)
+	DrawOverlay(ax, mode = 1)
 
 def onpeakpickingfinishedclick(event):
 	print("done")
@@ -417,42 +802,198 @@ def AddPointsAtPosition(position,data):
 		BaselinePoints[rowid].append([position,data[rowid][GetAxisIndexFromPosition(position)]])
 
 def GetAxisIndexFromPosition(position):
-	for i in range(len(XAXIS)):
-		pos = XAXIS[i]
-		if pos < position: return i
-
-def FitBaselines():
+	# Index of first axis point below position (axis is descending), also works on arrays of positions
+	idx = np.searchsorted(-XAXIS, -np.asarray(position), side = 'right')
+	if np.ndim(idx) == 0: return int(idx)
+	return idx
+
+def DetectBaselineRegions(spectrum):
+	# Classify points as baseline where the smoothed derivative and the residual are within the noise
+	margin = max(int(AUTO_BSL_MARGIN / abs(XAXIS[1] - XAXIS[0])), 1)
+	kernel = np.ones(5) / 5
+
+	derivative = np.gradient(np.convolve(spectrum, kernel, mode = 'same'))
+	noise = 1.4826 * np.median(np.abs(derivative - np.median(derivative)))
+	signal = np.abs(derivative) > AUTO_BSL_NOISE * noise
+	signal = DilateMask(signal, margin)
+
+	# Second pass, remove flat tops of broad signals above a low order fit of the baseline regions
+	if np.count_nonzero(~signal) > polydegree + 1:
+		fit = np.polyfit(XAXIS[~signal], spectrum[~signal], polydegree)
+		residual = spectrum - np.polyval(fit, XAXIS)
+		noise = 1.4826 * np.median(np.abs(residual[~signal] - np.median(residual[~signal])))
+		signal |= DilateMask(np.abs(residual) > AUTO_BSL_NOISE * noise, margin)
+
+	return ~signal
+
+def DilateMask(mask, width):
+	# Extend True regions by width points on both sides
+	counts = np.cumsum(np.concatenate([[0], mask.astype(int)]))
+	idx = np.arange(len(mask))
+	lo = np.clip(idx - width, 0, len(mask))
+	hi = np.clip(idx + width + 1, 0, len(mask))
+	return (counts[hi] - counts[lo]) > 0
+
+def PickBaselineIndices(mask):
+	# Evenly spaced points among the baseline points
+	idx = np.flatnonzero(mask)
+	if len(idx) == 0: return idx
+	return np.unique(idx[np.linspace(0, len(idx) - 1, min(AUTO_BSL_POINTS, len(idx))).astype(int)])
+
+@Profiled
+def AutoBaselinePoints(data):
+	print("Detecting baseline points...")
+	matrix = np.array([data[rowid] for rowid in data], dtype = float)[:, 0:len(XAXIS)]
+
+	if AUTO_BASELINE == 'row':
+		counts = []
+		for i, rowid in enumerate(data):
+			idx = PickBaselineIndices(DetectBaselineRegions(matrix[i]))
+			BaselinePoints[rowid] = [[XAXIS[j], matrix[i, j]] for j in idx]
+			counts.append(len(idx))
+		print(f"Baseline points per row = {min(counts, default = 0)} to {max(counts, default = 0)}")
+	else: # Shared points from the summed spectrum
+		idx = PickBaselineIndices(DetectBaselineRegions(matrix.sum(axis = 0)))
+		for i, rowid in enumerate(data):
+			BaselinePoints[rowid] = [[XAXIS[j], matrix[i, j]] for j in idx]
+		print(f"Baseline points = {len(idx)}")
+
+@Profiled
+def FitBaselines(data):
 	baselines = {}
+	rowids = list(data.keys())
 
-	for rowid in BaselinePoints:
-		if len(BaselinePoints[rowid]) < polydegree + 1: return baselines
+	if BASELINE_MODEL == 'rolling': # Does not use baseline points
+		values = RollingBaseline(np.array([data[rowid] for rowid in rowids], dtype = float)[:, 0:len(XAXIS)])
+		for i, rowid in enumerate(rowids):
+			baselines[rowid] = values[i]
+		return baselines
 
-		x = []
-		y = []
-		for point in BaselinePoints[rowid]:
-			x.append(point[0])
-			y.append(point[1])
+	# Rows with too few baseline points get no baseline, SubtractBaseline leaves them uncorrected
+	rowids = [rowid for rowid in rowids if len(BaselinePoints.get(rowid, [])) >= MinimumBaselinePoints()]
+	if len(rowids) == 0: return baselines
 
-		fit = FitBaseline(x,y)
+	x = [[point[0] for point in BaselinePoints[rowid]] for rowid in rowids]
+	y = [[point[1] for point in BaselinePoints[rowid]] for rowid in rowids]
 
-		baselines[rowid] = []
-		for i in XAXIS:
-			baselines[rowid].append(np.polyval(fit,i))
+	if all([xi == x[0] for xi in x]): # Shared baseline points, fit all rows in one call
+		values = BaselineValues(x[0], np.array(y).T)
+		for i, rowid in enumerate(rowids):
+			baselines[rowid] = values[:, i]
+	else:
+		for i, rowid in enumerate(rowids):
+			baselines[rowid] = BaselineValues(x[i], np.array(y[i])[:, None])[:, 0]
 
 	return baselines
 
+def MinimumBaselinePoints():
+	if BASELINE_MODEL == 'poly': return polydegree + 1
+	if BASELINE_MODEL == 'spline': return 2
+	return 1
+
+def BaselineValues(x, y):
+	# Baselines on the full axis for baseline points x and values y (points x rows), returns (axis x rows)
+	x = np.asarray(x, dtype = float)
+	y = np.asarray(y, dtype = float)
+
+	if BASELINE_MODEL == 'poly':
+		return np.vander(XAXIS, polydegree + 1) @ FitBaseline(x, y)
+
+	x, idx = np.unique(x, return_index = True) # Ascending, repeated clicks at the same position removed
+	y = y[idx]
+
+	if len(x) == 1: return np.repeat(y, len(XAXIS), axis = 0)
+	if BASELINE_MODEL == 'spline' and len(x) > 2: return SmoothingSpline(x, y)
+	return PiecewiseLinear(x, y)
+
 def FitBaseline(x,y):
 	return np.polyfit(x,y,polydegree)
 
+def KnotIntervals(x, axis):
+	# Interval index and position within the interval (0-1, outside the knots < 0 or > 1) for every axis point
+	j = np.clip(np.searchsorted(x, axis) - 1, 0, len(x) - 2)
+	h = x[j + 1] - x[j]
+	return j, (axis - x[j]) / h
+
+def PiecewiseLinear(x, y):
+	# Straight lines between the baseline points, constant outside
+	j, t = KnotIntervals(x, XAXIS)
+	t = np.clip(t, 0, 1)[:, None]
+	return (1 - t) * y[j] + t * y[j + 1]
+
+def SmoothingSpline(x, y):
+	# Natural cubic smoothing spline (Reinsch), minimizes sum (y - g)^2 + SMOOTHING * integral g''^2
+	# The smoother matrix only depends on the baseline point positions and is applied to all rows at once
+	n = len(x)
+	u = (x - x[0]) / (x[-1] - x[0])
+	axis = (XAXIS - x[0]) / (x[-1] - x[0])
+	h = np.diff(u)
+
+	Q = np.zeros((n, n - 2))
+	R = np.zeros((n - 2, n - 2))
+	for j in range(1, n - 1):
+		Q[j - 1, j - 1] = 1 / h[j - 1]
+		Q[j, j - 1] = -1 / h[j - 1] - 1 / h[j]
+		Q[j + 1, j - 1] = 1 / h[j]
+		R[j - 1, j - 1] = (h[j - 1] + h[j]) / 3
+		if j < n - 2: R[j - 1, j] = R[j, j - 1] = h[j] / 6
+
+	RQT = np.linalg.solve(R, Q.T)
+	g = np.linalg.solve(np.eye(n) + SMOOTHING * Q @ RQT, y) # Smoothed values at the baseline points
+	gamma = np.zeros_like(g) # Second derivatives, zero at the ends
+	gamma[1:-1] = RQT @ g
+
+	j, t = KnotIntervals(u, axis)
+	tc = np.clip(t, 0, 1)[:, None]
+	hj = h[j][:, None]
+	values = (1 - tc) * g[j] + tc * g[j + 1] - hj**2 / 6 * tc * (1 - tc) * ((1 + tc) * gamma[j + 1] + (2 - tc) * gamma[j])
+
+	# Linear outside the baseline points
+	below = axis < 0
+	above = axis > 1
+	slope0 = (g[1] - g[0]) / h[0] - h[0] / 6 * gamma[1]
+	slope1 = (g[-1] - g[-2]) / h[-1] + h[-1] / 6 * gamma[-2]
+	values[below] += axis[below][:, None] * slope0
+	values[above] += (axis[above] - 1)[:, None] * slope1
+
+	return values
+
+def RollingMinimum(matrix, window):
+	# Centered moving minimum along the rows (van Herk/Gil-Werman, three comparisons per point independent of window)
+	rows, n = matrix.shape
+	padded = np.pad(matrix, ((0, 0), (window // 2, window - 1 - window // 2)), mode = 'edge')
+	extra = -padded.shape[1] % window
+	padded = np.pad(padded, ((0, 0), (0, extra)), constant_values = np.inf)
+
+	blocks = padded.reshape(rows, -1, window)
+	prefix = np.minimum.accumulate(blocks, axis = 2).reshape(rows, -1)
+	suffix = np.minimum.accumulate(blocks[:, :, ::-1], axis = 2)[:, :, ::-1].reshape(rows, -1)
+	return np.minimum(suffix[:, 0:n], prefix[:, window - 1:window - 1 + n])
+
+def RollingMean(matrix, window):
+	rows, n = matrix.shape
+	padded = np.pad(matrix, ((0, 0), (window // 2, window - 1 - window // 2)), mode = 'edge')
+	counts = np.cumsum(np.pad(padded, ((0, 0), (1, 0))), axis = 1)
+	return (counts[:, window:window + n] - counts[:, 0:n]) / window
+
+def RollingBaseline(matrix):
+	# Rolling minimum followed by a rolling maximum (removes peaks narrower than the window), smoothed by a rolling mean
+	window = max(int(BSL_WINDOW / abs(XAXIS[1] - XAXIS[0])), 3)
+	opened = -RollingMinimum(-RollingMinimum(matrix, window), window)
+	return RollingMean(opened, window)
+
+@Profiled
 def SubtractBaseline(data):
 	baselinecorrected = {}
 
 	for rowid in data:
+		row = np.asarray(data[rowid], dtype = float)[0:len(XAXIS)]
+		if rowid not in Baselines: # Too few baseline points to fit, e.g. auto detection failed on this spectrum
+			print(f"Warning: no baseline for row {rowid} (fewer than {MinimumBaselinePoints()} baseline points), row is not baseline corrected")
+			baselinecorrected[rowid] = row
+			continue
 		bsl = Baselines[rowid]
-		dat = data[rowid]
-		baselinecorrected[rowid] = []
-		for i in range(len(bsl)):
-			baselinecorrected[rowid].append(dat[i]-bsl[i])
+		baselinecorrected[rowid] = row[0:len(bsl)] - bsl
 
 	return baselinecorrected
 
@@ -488,6 +1029,10 @@ def AddPeakRangePoint(position, data):
 		PEAKPOINTS.append(position)
 
 def ReferenceSpectra(position, data):
+	if REF_MODE == 'auto':
+		AutoReferenceSpectra(position, data)
+		return
+
 	axis_idx = GetAxisIndexFromPosition(position)
 
 	for rowid in data:
@@ -525,7 +1070,48 @@ def RefSpectrum(idx, spectrum, rowid):
 	print(str(rowid) + ": " + str(OFFSET[rowid]))
 	
 
+def AutoReferenceSpectra(position, data):
+	# Align all rows to the reference row by FFT cross-correlation of the window around position
+	global OFFSET
+	rowids = list(data.keys())
+	refrow = REF_ROW if REF_ROW in data else rowids[0]
+
+	idx_start = GetAxisIndexFromPosition(position + REF_WINDOW)
+	idx_end = GetAxisIndexFromPosition(position - REF_WINDOW)
+	window = np.array([data[rowid][idx_start:idx_end] for rowid in rowids], dtype = float)
+	window -= window.mean(axis = 1, keepdims = True)
+	n = window.shape[1]
+
+	if n < 3:
+		print("Reference window too small")
+		return
+
+	# Cross-correlation of every row with the reference row, zero padded to avoid wrap around
+	spectra = np.fft.rfft(window, n = 2*n, axis = 1)
+	xcorr = np.fft.irfft(spectra * np.conj(spectra[rowids.index(refrow)]), n = 2*n, axis = 1)
+	xcorr = np.roll(xcorr, n - 1, axis = 1)[:,:2*n - 1] # Column j is lag j - (n - 1)
+
+	# Sub-point lag from parabola through the maximum and its neighbours
+	peak = np.clip(np.argmax(xcorr, axis = 1), 1, 2*n - 3)
+	rows = np.arange(len(rowids))
+	y0 = xcorr[rows, peak - 1]
+	y1 = xcorr[rows, peak]
+	y2 = xcorr[rows, peak + 1]
+	denom = y0 - 2*y1 + y2
+	delta = np.where(denom != 0, 0.5 * (y0 - y2) / np.where(denom != 0, denom, 1), 0)
+	lags = peak - (n - 1) + delta
+
+	shifts = lags * (XAXIS[1] - XAXIS[0])
+	for rowid, shift in zip(rowids, shifts):
+		OFFSET[rowid] = shift
+		print(str(rowid) + ": " + str(OFFSET[rowid]))
+
+@Profiled
 def PrintData(dat):
+	if OUTPUT_FORMAT in ['npy','npz']:
+		PrintBinaryData(dat)
+		return
+
 	header = "ppm "
 	for rowid in dat:
 		header += str(rowid) + " "
@@ -538,24 +1124,199 @@ def PrintData(dat):
 				out += str(row[i]) + " "
 			f.write(out.strip() + "\n")
 
+def PrintBinaryData(dat):
+	# Write the full dataset in a single call instead of line by line
+	rowids = np.array(list(dat.keys()))
+	ppm = np.array(XAXIS[0:DataPointCount])
+	matrix = np.array([dat[rowid][0:DataPointCount] for rowid in dat])
+
+	if OUTPUT_FORMAT == 'npz': # Named arrays: ppm, rows, data (rows x points)
+		np.savez(FILENAME + "_baselined.npz", ppm = ppm, rows = rowids, data = matrix)
+	else: # Single table, first row is ppm axis, first column is row ids. Load with np.load(path, mmap_mode='r')
+		table = np.empty((len(rowids) + 1, DataPointCount + 1))
+		table[0,0] = np.nan
+		table[0,1:] = ppm
+		table[1:,0] = rowids
+		table[1:,1:] = matrix
+		np.save(FILENAME + "_baselined.npy", table)
+
+def BuildIntegrationTable(data):
+	# Cumulative integral of every row, a region integral is then the difference of two columns
+	matrix = np.array([data[rowid] for rowid in data], dtype = float)
+
+	if INTEGRATION_MODE == 'trapz': # table[:, k] = integral from point 0 to point k in ppm units
+		dppm = abs(XAXIS[1] - XAXIS[0])
+		table = np.zeros(matrix.shape)
+		np.cumsum(0.5 * dppm * (matrix[:,1:] + matrix[:,:-1]), axis = 1, out = table[:,1:])
+	else: # table[:, k] = sum of points 0 to k - 1
+		table = np.zeros((matrix.shape[0], matrix.shape[1] + 1))
+		np.cumsum(matrix, axis = 1, out = table[:,1:])
+
+	return table
+
+def IntegrateRegions(table, idx_start, idx_end):
+	# Volumes of the point ranges [idx_start, idx_end) for all rows, returned as (peaks x rows)
+	idx_start = np.atleast_1d(idx_start)
+	idx_end = np.atleast_1d(idx_end)
+
+	if INTEGRATION_MODE == 'trapz':
+		last = table.shape[1] - 1 # Regions outside the axis are empty ranges, set to 0 below
+		volumes = table[:, np.clip(idx_end - 1, 0, last)] - table[:, np.clip(idx_start, 0, last)]
+	else:
+		volumes = table[:, idx_end] - table[:, idx_start]
+
+	volumes[:, idx_end <= idx_start] = 0 # Empty range
+	return volumes.T
+
+def LineShapes(axis, centers, widths, etas):
+	# Unit height lines (points x peaks), widths are half widths at half height. Pseudo-Voigt: eta * Lorentz + (1 - eta) * Gauss
+	d = (axis[:, None] - centers[None, :]) / widths[None, :]
+	lines = 1 / (1 + d**2)
+	if LINE_SHAPE == 'voigt':
+		lines = etas[None, :] * lines + (1 - etas[None, :]) * np.exp(-np.log(2) * d**2)
+	return lines
+
+def LineShapeAreas(widths, etas):
+	# Area of a unit height line in ppm
+	areas = np.pi * widths
+	if LINE_SHAPE == 'voigt':
+		areas = etas * areas + (1 - etas) * widths * np.sqrt(np.pi / np.log(2))
+	return areas
+
+def PeakClusters(idx_start, idx_end, size):
+	# Groups of peaks whose fit windows overlap, returned as (peak indices, first point, last point + 1)
+	margin = (FIT_MARGIN * (idx_end - idx_start)).astype(int)
+	lo = np.clip(idx_start - margin, 0, size)
+	hi = np.clip(idx_end + margin, 0, size)
+
+	clusters = []
+	for i in np.argsort(lo):
+		if len(clusters) > 0 and lo[i] < clusters[-1][2]:
+			clusters[-1][0].append(i)
+			clusters[-1][2] = max(clusters[-1][2], hi[i])
+		else: clusters.append([[i], lo[i], hi[i]])
+	return clusters
+
+def UnpackLineParameters(theta, count):
+	centers = theta[0:count]
+	widths = np.exp(theta[count:2*count])
+	etas = 1 / (1 + np.exp(-theta[2*count:3*count])) if LINE_SHAPE == 'voigt' else np.ones(count)
+	return centers, widths, etas
+
+def LineShapeResiduals(theta, axis, Y, count):
+	# Variable projection: for given positions and widths the amplitudes of all rows follow from one linear least squares
+	B = LineShapes(axis, *UnpackLineParameters(theta, count))
+	amplitudes = np.linalg.lstsq(B, Y, rcond = None)[0]
+	return (Y - B @ amplitudes).ravel(), amplitudes
+
+def FitCluster(axis, Y, centers, widths):
+	# Levenberg-Marquardt on the shared line parameters with a finite difference Jacobian, Y is (points x rows)
+	count = len(centers)
+	theta = np.concatenate([centers, np.log(widths)] + ([np.zeros(count)] if LINE_SHAPE == 'voigt' else []))
+	steps = np.concatenate([np.full(count, 1e-3 * abs(axis[1] - axis[0])), np.full(len(theta) - count, 1e-4)])
+
+	r, amplitudes = LineShapeResiduals(theta, axis, Y, count)
+	cost = r @ r
+	damping = 1e-3
+
+	for iteration in range(FIT_ITERATIONS):
+		J = np.empty((len(r), len(theta)))
+		for j in range(len(theta)):
+			trial = theta.copy()
+			trial[j] += steps[j]
+			J[:, j] = (LineShapeResiduals(trial, axis, Y, count)[0] - r) / steps[j]
+
+		JTJ = J.T @ J
+		step = np.linalg.solve(JTJ + damping * np.diag(np.diag(JTJ)) + 1e-12 * np.eye(len(theta)), -J.T @ r)
+		trial = theta + step
+		trial[0:count] = np.clip(trial[0:count], axis.min(), axis.max())
+
+		trial_r, trial_amplitudes = LineShapeResiduals(trial, axis, Y, count)
+		trial_cost = trial_r @ trial_r
+
+		if trial_cost < cost:
+			converged = cost - trial_cost <= 1e-10 * cost
+			theta, r, amplitudes, cost = trial, trial_r, trial_amplitudes, trial_cost
+			damping = damping / 3
+			if converged: break
+		else:
+			damping = damping * 4
+			if damping > 1e10: break
+
+	return UnpackLineParameters(theta, count), amplitudes
+
+@Profiled
+def FitPeakVolumes(data, idx_start, idx_end, fixed = None):
+	# Peak areas (peaks x rows) from line shapes fitted to all rows together, positions and widths shared across rows
+	# If fixed line parameters are given only the amplitudes are fitted (new experiments in watch mode)
+	matrix = np.array([data[rowid] for rowid in data], dtype = float)[:, 0:len(XAXIS)]
+	dppm = abs(XAXIS[1] - XAXIS[0])
+	idx_start, idx_end = np.minimum(idx_start, idx_end), np.maximum(idx_start, idx_end)
+	idx_end = np.clip(np.maximum(idx_end, idx_start + 1), 0, len(XAXIS)) # At least one point per region
+	idx_start = np.minimum(idx_start, idx_end - 1)
+	volumes = np.zeros((len(idx_start), matrix.shape[0]))
+	fits = [None] * len(idx_start)
+
+	for peaks, lo, hi in PeakClusters(idx_start, idx_end, len(XAXIS)):
+		axis = XAXIS[lo:hi]
+		Y = matrix[:, lo:hi].T
+
+		if fixed is not None:
+			centers, widths, etas = [np.array([fixed[i][k] for i in peaks]) for k in range(3)]
+			amplitudes = np.linalg.lstsq(LineShapes(axis, centers, widths, etas), Y, rcond = None)[0]
+			for j, i in enumerate(peaks):
+				volumes[i] = amplitudes[j] * LineShapeAreas(widths, etas)[j] / (1 if INTEGRATION_MODE == 'trapz' else dppm)
+				fits[i] = fixed[i]
+			continue
+
+		# Initial guess from the mean spectrum: highest point in the central half and width at half height of each peak region
+		mean = np.abs(Y.mean(axis = 1))
+		centers = []
+		widths = []
+		for i in peaks:
+			quarter = (idx_end[i] - idx_start[i]) // 4
+			region = mean[idx_start[i] - lo + quarter:idx_end[i] - lo - quarter]
+			center = XAXIS[idx_start[i] + quarter + np.argmax(region)]
+			if any([abs(center - c) < 2 * dppm for c in centers]): center = XAXIS[(idx_start[i] + idx_end[i]) // 2] # Same maximum as another peak
+			centers.append(center)
+			widths.append(max(np.count_nonzero(region > region.max() / 2) / 2, 1) * dppm)
+
+		(centers, widths, etas), amplitudes = FitCluster(axis, Y, np.array(centers), np.array(widths))
+		areas = LineShapeAreas(widths, etas)
+		if INTEGRATION_MODE != 'trapz': areas = areas / dppm # Sum of points units, comparable to box integration
+
+		for j, i in enumerate(peaks):
+			volumes[i] = amplitudes[j] * areas[j]
+			fits[i] = (centers[j], widths[j], etas[j])
+
+	return volumes, fits
+
+def PeakVolumes(data, refit = True):
+	# Volumes (peaks x rows) of the peaks in PEAKPOINTS
+	global LINE_FITS
+	peakcount = len(PEAKPOINTS) // 2
+	idx_start = GetAxisIndexFromPosition(np.array(PEAKPOINTS[0:2*peakcount:2]))
+	idx_end = GetAxisIndexFromPosition(np.array(PEAKPOINTS[1:2*peakcount:2]))
+
+	if QUANT_MODE == 'fit':
+		volumes, LINE_FITS = FitPeakVolumes(data, idx_start, idx_end, None if refit else LINE_FITS)
+		return volumes
+
+	return IntegrateRegions(BuildIntegrationTable(data), idx_start, idx_end)
+
+@Profiled
 def ExportPeakVolumes(data):
-	volumes = {}
-	peakcount = 0
-
-	for rowid in data: volumes[rowid] = []
+	peakcount = len(PEAKPOINTS) // 2
+	peakstarts = np.array(PEAKPOINTS[0:2*peakcount:2])
+	peakends = np.array(PEAKPOINTS[1:2*peakcount:2])
+	idx_start = GetAxisIndexFromPosition(peakstarts)
+	idx_end = GetAxisIndexFromPosition(peakends)
 
-	for i in range(0,len(PEAKPOINTS) - 1,2):
-		peakstart = PEAKPOINTS[i]
-		peakend = PEAKPOINTS[i+1]
-		idx_start = GetAxisIndexFromPosition(peakstart)
-		idx_end = GetAxisIndexFromPosition(peakend)
-		peakcount += 1
+	for i in range(peakcount):
+		print(peakstarts[i],peakends[i],idx_start[i],idx_end[i])
 
-		print(peakstart,peakend,idx_start,idx_end)
-
-		for rowid in data:
-			volume = sum(data[rowid][idx_start:idx_end])
-			volumes[rowid].append(volume)
+	volumes = PeakVolumes(data)
+	fits = LINE_FITS
 
 	header = "peak "
 	for rowid in data:
@@ -565,31 +1326,169 @@ def ExportPeakVolumes(data):
 		f.write("Peak integration information\n")
 		if SAME_WIDTH_PEAK_MODE:
 			f.write(f"SAME_WIDTH_PEAK_MODE enabled\nWidth = {PEAK_WIDTH}\n")
+		if INTEGRATION_MODE == 'trapz':
+			f.write("Trapezoidal integration, ppm units\n")
 		n = 0
 		for i in range(0,len(PEAKPOINTS) - 1,2):
 			f.write(f"Peak #{n}, start = {PEAKPOINTS[i]}ppm, end = {PEAKPOINTS[i+1]}ppm\n")
 			n += 1
+		if QUANT_MODE == 'fit':
+			f.write(f"Line shape fit ({LINE_SHAPE}), peak areas\n")
+			for i in range(peakcount):
+				f.write(f"Fit #{i}, center = {fits[i][0]}ppm, hwhm = {fits[i][1]}ppm, eta = {fits[i][2]}\n")
 		f.write("\n")
 			
 		f.write(header + "\n")
 		for i in range(peakcount):
 			out = str(i) + " "
-			for rowid in volumes:
-				vs = volumes[rowid]
-				out += str(vs[i]) + " "
+			for v in volumes[i]:
+				out += str(v) + " "
 			f.write(out.strip() + "\n")
-	
+
+	return volumes
+
+def WriteIntegrals(rowids, volumes, mode = 'w'):
+	# One line per experiment, new experiments are appended in watch mode
+	with open(FILENAME + "_integrals.txt", mode) as f:
+		if mode == 'w': f.write("row " + " ".join([str(i) for i in range(len(volumes))]) + "\n")
+		for j, rowid in enumerate(rowids):
+			f.write(str(rowid) + " " + " ".join([str(v) for v in volumes[:, j]]) + "\n")
+
+def SaveSetup(data):
+	# Baseline and peak configuration, can be applied to other data or new experiments with -setup
+	global BASELINE_POSITIONS
+	rowids = list(data.keys())
+	BASELINE_POSITIONS = [float(bp[0]) for bp in BaselinePoints[rowids[0]]] if len(rowids) > 0 else []
+
+	setup = {
+		'baseline_model': BASELINE_MODEL,
+		'polydegree': polydegree,
+		'smoothing': SMOOTHING,
+		'bsl_window': BSL_WINDOW,
+		'auto_baseline': AUTO_BASELINE,
+		'baseline_points': BASELINE_POSITIONS,
+		'peaks': [float(v) for v in PEAKPOINTS],
+		'peak_width': PEAK_WIDTH,
+		'same_width_peak_mode': SAME_WIDTH_PEAK_MODE,
+		'integration': INTEGRATION_MODE,
+		'quant': QUANT_MODE,
+		'lineshape': LINE_SHAPE,
+		'region': REGION,
+	}
+
+	with open(FILENAME + "_setup.json","w+") as f:
+		json.dump(setup, f, indent = 1)
+
+def LoadSetup(path):
+	global BASELINE_MODEL, polydegree, SMOOTHING, BSL_WINDOW, AUTO_BASELINE, BASELINE_POSITIONS
+	global PEAK_WIDTH, SAME_WIDTH_PEAK_MODE, INTEGRATION_MODE, QUANT_MODE, LINE_SHAPE, REGION
+
+	print("Loading setup: " + path)
+	with open(path) as f:
+		setup = json.load(f)
+
+	BASELINE_MODEL = setup['baseline_model']
+	polydegree = setup['polydegree']
+	SMOOTHING = setup['smoothing']
+	BSL_WINDOW = setup['bsl_window']
+	AUTO_BASELINE = 'row' if setup['auto_baseline'] == 'row' else None # Otherwise the saved points are used
+	BASELINE_POSITIONS = setup['baseline_points']
+	PEAKPOINTS[:] = setup['peaks']
+	PEAK_WIDTH = setup['peak_width']
+	SAME_WIDTH_PEAK_MODE = setup['same_width_peak_mode']
+	INTEGRATION_MODE = setup['integration']
+	QUANT_MODE = setup['quant']
+	LINE_SHAPE = setup['lineshape']
+	REGION = setup['region']
+
+def SetBaselinePoints(data, positions):
+	# Nearest axis point of each saved position
+	step = XAXIS[0] - XAXIS[1]
+	idx = np.clip(np.rint((XAXIS[0] - np.array(positions, dtype = float)) / step).astype(int), 0, len(XAXIS) - 1)
+	for rowid in data:
+		BaselinePoints[rowid] = [[XAXIS[i], data[rowid][i]] for i in idx]
+
+def ProcessNewExperiments(data, files):
+	# Apply the baseline and peak setup to new experiments only and append their integrals
+	new = {}
+	for expno in sorted(files):
+		header = ReadHeader(files[expno])
+		if None in header.values():
+			print(f"Invalid header: {files[expno]}")
+			continue
+		new[expno] = np.zeros(len(XAXIS))
+		ReadFolderSpectrum(files[expno], header, new[expno])
+		BaselinePoints[expno] = []
+
+	if len(new) == 0: return
+
+	if BASELINE_MODEL != 'rolling':
+		if AUTO_BASELINE == 'row': AutoBaselinePoints(new)
+		else: SetBaselinePoints(new, BASELINE_POSITIONS)
+	Baselines.update(FitBaselines(new))
+
+	corr = SubtractBaseline(new)
+	volumes = PeakVolumes(corr, refit = False)
+	WriteIntegrals(list(corr.keys()), volumes, 'a')
+	data.update(new)
+
+	for j, expno in enumerate(corr):
+		print(f"{expno}: " + " ".join([f"{v:.6g}" for v in volumes[:, j]]))
+
+def WatchFolder(data):
+	# Poll the folder for new experiments, a file is read once its size has not changed between two polls
+	if IdentifyInputData() != 'dir':
+		print("Watch mode requires a folder of totxt exports")
+		return
+
+	print(f"Watching {PATH} every {WATCH_INTERVAL} s, press Ctrl+C to stop")
+	sizes = {}
+	done = set(data.keys())
+
+	try:
+		while True:
+			time.sleep(WATCH_INTERVAL)
+			ready = {}
+			for expno, path in ListFolderFiles(verbose = False).items():
+				if expno in done: continue
+				size = os.path.getsize(path)
+				if size > 0 and sizes.get(expno) == size: ready[expno] = path
+				sizes[expno] = size
+
+			if len(ready) > 0:
+				ProcessNewExperiments(data, ready)
+				done.update(ready.keys())
+	except KeyboardInterrupt:
+		print()
+		print("Stopped watching")
+
+def SetPeaksFromArgs():
+	print("Peaks from arguments: " + str(ARG_PEAKS))
+	for position in ARG_PEAKS:
+		if SAME_WIDTH_PEAK_MODE and PEAK_WIDTH is not None: AddPeakRangePoint(position, None) # Peak centers
+		else: PEAKPOINTS.append(position)
+
 def Main():
 	global DataPointCount
+	global Baselines
 
 	print("Reading Path: " + FILENAME)
 
+	if SETUP is not None: LoadSetup(SETUP)
+
 	if IdentifyInputData() == 'dir': data,DataPointCount = ReadFolderData()
 	else: data,DataPointCount = ReadData()
 
 	for rowid in data: BaselinePoints[rowid] = []
 
-	BaselineCorrect(data)
+	if AUTO_BASELINE is not None and BASELINE_MODEL != 'rolling':
+		AutoBaselinePoints(data)
+	elif SETUP is not None and BASELINE_MODEL != 'rolling':
+		SetBaselinePoints(data, BASELINE_POSITIONS)
+	if AUTO_BASELINE is not None or BASELINE_MODEL == 'rolling' or SETUP is not None:
+		Baselines = FitBaselines(data)
+
+	if not HEADLESS and SETUP is None: BaselineCorrect(data)
 
 	print("Subtracting baselines...")
 	corr = SubtractBaseline(data)
@@ -598,9 +1497,16 @@ def Main():
 	PrintData(corr)
 	print("Done")
 
-	PeakPicking(corr)
+	if SETUP is not None: print("Peaks from setup: " + str(PEAKPOINTS))
+	elif HEADLESS: SetPeaksFromArgs()
+	else: PeakPicking(corr)
+
+	volumes = ExportPeakVolumes(corr)
+	SaveSetup(data)
 
-	ExportPeakVolumes(corr)
+	if WATCH:
+		WriteIntegrals(list(corr.keys()), volumes, 'w')
+		WatchFolder(data)
 
 	if SAME_WIDTH_PEAK_MODE: 
 		print("Consistent Peak Width Mode Command:")
@@ -0,0 +1,188 @@
+"""
+NMR Processing Throughput Benchmark
+
+This script generates synthetic pseudo-2D spectra with GenerateSpectra.py, processes them with
+1DBaselineCorrection.py in headless mode with profiling enabled and reports the throughput (points per second) of
+each processing stage. The peak volumes written by the tool are compared to the ground truth of the generator, so
+that speed optimizations can be checked for accuracy. With '-quant fit' in the tool options, the fitted peak areas are
+compared to the full line areas.
+
+Stages:
+	load        :	ReadData / ReadFolderData
+	baseline    :	AutoBaselinePoints + FitBaselines
+	subtraction :	SubtractBaseline
+	integration :	ExportPeakVolumes
+	export      :	PrintData
+
+Usage:
+python3 BenchmarkNMR.py <options>
+Options:
+-sizes X     :	comma separated data set sizes as rows x points [default 16x16384,64x32768,256x65536]
+-peaks X     :	number of peaks [default 4]
+-noise X     :	noise level, see GenerateSpectra.py [default 0.01]
+-curvature X :	baseline curvature, see GenerateSpectra.py [default 0.2]
+-repeat X    :	number of timed runs per data set, the fastest run is reported [default 3]. Peak memory is
+		measured in one additional run with memory tracing (-profilememory), which is not timed
+-folder      :	benchmark folder input (<expno>.txt files) instead of a single pseudo-2D file
+-format X    :	output format passed to the tool [default txt]
+-options X   :	additional options passed to the tool, as one quoted string
+-out X       :	write the report to file X
+-keep        :	keep the generated data and outputs in ./benchmark_data
+
+Author: Frederik Theisen, 2024
+"""
+
+import sys
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import numpy as np
+
+import GenerateSpectra
+
+TOOL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '1DBaselineCorrection.py')
+
+STAGES = {
+	'load': ['ReadData', 'ReadFolderData'],
+	'baseline': ['AutoBaselinePoints', 'FitBaselines'],
+	'subtraction': ['SubtractBaseline'],
+	'integration': ['ExportPeakVolumes'], # Includes FitPeakVolumes
+	'export': ['PrintData'],
+}
+
+def ReadProfile(path):
+	# Returns {stage: (calls, time_s, peak_MB)} from <name>_profile.txt
+	profile = {}
+	with open(path) as f:
+		f.readline() # Header
+		for line in f:
+			dat = line.split()
+			if len(dat) < 5: continue
+			profile[dat[0]] = (int(dat[1]), float(dat[2]), float(dat[4]))
+	return profile
+
+def RunTool(path, regions, workdir, format = 'txt', options = [], memory = False):
+	# Runs the tool headless in workdir, returns wall time and the profile. With memory the stages are traced with
+	# tracemalloc (-profilememory), which slows them down, so such runs are only used for the peak memory
+	profile = '-profilememory' if memory else '-profile'
+	command = [sys.executable, TOOL, path, '-headless', '-mode', '1', profile, '-format', format, '-peaks']
+	command += [str(v) for v in regions] + options
+
+	start = time.perf_counter()
+	result = subprocess.run(command, cwd = workdir, stdout = subprocess.PIPE, stderr = subprocess.STDOUT, text = True)
+	elapsed = time.perf_counter() - start
+
+	if result.returncode != 0:
+		print(result.stdout)
+		raise RuntimeError(f"1DBaselineCorrection.py failed on {path}")
+
+	name = os.path.basename(path).split('.')[0]
+	return elapsed, ReadProfile(os.path.join(workdir, name + "_profile.txt"))
+
+def StageTimes(profile):
+	times = {}
+	for stage in STAGES:
+		times[stage] = sum([profile[f][1] for f in STAGES[stage] if f in profile])
+	return times
+
+def CompareVolumes(truth, peaks):
+	# Relative error of the volumes, normalized by the largest true volume of each peak
+	_, expected = GenerateSpectra.ReadPeakVolumes(truth)
+	_, measured = GenerateSpectra.ReadPeakVolumes(peaks)
+	if expected.shape != measured.shape: return np.nan, np.nan
+	error = np.abs(measured - expected) / np.abs(expected).max(axis = 1)[:,None]
+	return float(error.max()), float(np.sqrt(np.mean(error**2)))
+
+def Benchmark(rows, points, workdir, peaks = 4, noise = 0.01, curvature = 0.2, repeat = 3, folder = False, format = 'txt', options = []):
+	name = os.path.join(workdir, f"bench_{rows}x{points}")
+	path, truth = GenerateSpectra.Generate(name, rows, points, peaks, noise, curvature, folder = folder)
+	regions, _ = GenerateSpectra.ReadPeakVolumes(truth)
+
+	best = None
+	for i in range(repeat):
+		elapsed, profile = RunTool(path, regions, workdir, format, options)
+		times = StageTimes(profile)
+		if best is None or elapsed < best['wall']:
+			best = {'wall': elapsed, 'times': times}
+
+	# Peak memory in a separate traced run, so the timed runs above are not slowed down by tracing
+	_, profile = RunTool(path, regions, workdir, format, options, memory = True)
+	best['memory'] = max([v[2] for v in profile.values()])
+
+	if 'fit' in options and '-quant' in options: truth = name + "_areas.txt"
+	maxerror, rmserror = CompareVolumes(truth, name + "_peaks.txt")
+	best.update({'rows': rows, 'points': points, 'maxerror': maxerror, 'rmserror': rmserror})
+	return best
+
+def FormatReport(results):
+	lines = [f"{'data set':<14} " + " ".join([f"{stage:>12}" for stage in STAGES]) + f" {'wall_s':>8} {'peak_MB':>8} {'max_err':>9} {'rms_err':>9}"]
+	for result in results:
+		total = result['rows'] * result['points']
+		line = f"{str(result['rows']) + 'x' + str(result['points']):<14} "
+		for stage in STAGES:
+			t = result['times'][stage]
+			line += f"{total / t if t > 0 else np.inf:>12.3g} "
+		line += f"{result['wall']:>8.2f} {result['memory']:>8.1f} {result['maxerror']:>9.2e} {result['rmserror']:>9.2e}"
+		lines.append(line)
+	return "Throughput in points per second\n" + "\n".join(lines)
+
+def Main():
+	args = sys.argv
+
+	if '-help' in args or '-h' in args:
+		print(__doc__)
+		return
+
+	sizes = "16x16384,64x32768,256x65536"
+	settings = {'peaks': 4, 'noise': 0.01, 'curvature': 0.2, 'repeat': 3}
+	format = 'txt'
+	options = []
+	out = None
+
+	if '-sizes' in args:
+		idx = args.index('-sizes')
+		sizes = args[idx + 1]
+
+	for setting in settings:
+		if '-' + setting in args:
+			idx = args.index('-' + setting)
+			settings[setting] = type(settings[setting])(args[idx + 1])
+
+	if '-format' in args:
+		idx = args.index('-format')
+		format = args[idx + 1]
+
+	if '-options' in args:
+		idx = args.index('-options')
+		options = args[idx + 1].split()
+
+	if '-out' in args:
+		idx = args.index('-out')
+		out = args[idx + 1]
+
+	if '-keep' in args:
+		workdir = os.path.abspath('benchmark_data')
+		os.makedirs(workdir, exist_ok = True)
+	else: workdir = tempfile.mkdtemp(prefix = 'nmrbench_')
+
+	results = []
+	try:
+		for size in sizes.split(','):
+			rows, points = [int(v) for v in size.lower().split('x')]
+			print(f"BENCHMARKING {rows} ROWS x {points} POINTS...")
+			results.append(Benchmark(rows, points, workdir, folder = '-folder' in args, format = format, options = options, **settings))
+	finally:
+		if '-keep' not in args: shutil.rmtree(workdir, ignore_errors = True)
+
+	report = FormatReport(results)
+	print()
+	print(report)
+
+	if out is not None:
+		with open(out, 'w') as f:
+			f.write(report + '\n')
+
+if __name__ == '__main__':
+	Main()
@@ -0,0 +1,168 @@
+"""
+Synthetic TopSpin 'totxt' Spectra Generator
+
+This script writes synthetic pseudo-2D spectra in the format read by 1DBaselineCorrection.py, either as a single
+pseudo-2D export ('# F2LEFT', '# NCOLS', '# row = X') or as a folder of 1D exports named <expno>.txt ('# LEFT',
+'# SIZE') as written by the multitotxt AU program. Spectra contain Lorentzian peaks with row dependent amplitudes
+(exponential approach to equilibrium), a curved polynomial baseline and gaussian noise.
+
+The ground truth is written to <name>_truth.txt: one integration region per peak and the volume of the noise and
+baseline free signal inside each region for every row, computed as the sum of points like ExportPeakVolumes does.
+The full areas of the lines in the same units (for the line shape fit, -quant fit) are written to <name>_areas.txt.
+
+Usage:
+python3 GenerateSpectra.py <output name> <options>
+Options:
+-rows X      :	number of rows (spectra) [default 16]
+-points X    :	number of points per row [default 16384]
+-peaks X     :	number of peaks [default 4]
+-noise X     :	noise standard deviation relative to the smallest peak height [default 0.01]
+-curvature X :	baseline curvature relative to the largest peak height [default 0.2]
+-seed X      :	random seed [default 0]
+-folder      :	write a folder of <expno>.txt files instead of a single pseudo-2D file
+
+Author: Frederik Theisen, 2024
+"""
+
+import sys
+import os
+import numpy as np
+
+LEFT = 12.0
+RIGHT = -2.0
+REGION_WIDTHS = 4 # Integration region is peak center +- REGION_WIDTHS * half width
+
+def GenerateSpectra(rows = 16, points = 16384, peaks = 4, noise = 0.01, curvature = 0.2, seed = 0):
+	# Returns axis, spectra (rows x points), pure peak signal (rows x points) and peak parameters
+	rng = np.random.default_rng(seed)
+	axis = np.linspace(LEFT, RIGHT, points)
+
+	# Peaks spread over the spectrum, separated by more than their integration regions: centers closer than the
+	# sum of the two half regions (REGION_WIDTHS * half width each) are drawn again
+	widths = rng.uniform(0.004, 0.02, peaks) # Half width at half height, ppm
+	centers = np.zeros(peaks)
+	for i in range(peaks):
+		for attempt in range(10000):
+			centers[i] = rng.uniform(RIGHT + 1, LEFT - 1)
+			if np.all(np.abs(centers[:i] - centers[i]) > REGION_WIDTHS * (widths[:i] + widths[i])): break
+		else: raise ValueError(f"Could not place {peaks} peaks without overlapping integration regions")
+	order = np.argsort(centers)[::-1]
+	centers = centers[order]
+	widths = widths[order]
+	heights = rng.uniform(50, 200, peaks)
+	rates = rng.uniform(0.05, 0.5, peaks) # Amplitude change per row
+	final = rng.uniform(0.3, 1.0, peaks)
+
+	t = np.arange(rows)
+	amplitudes = heights[None,:] * (final[None,:] + (1 - final[None,:]) * np.exp(-rates[None,:] * t[:,None]))
+
+	# Lorentzian line shapes, (peaks x points)
+	lines = 1 / (1 + ((axis[None,:] - centers[:,None]) / widths[:,None])**2)
+	signal = amplitudes @ lines
+
+	# Curved baseline, different for each row
+	x = (axis - RIGHT) / (LEFT - RIGHT) * 2 - 1
+	coefficients = rng.normal(0, 1, (rows, 3)) * curvature * heights.max()
+	baseline = coefficients[:,0,None] + coefficients[:,1,None] * x[None,:] + coefficients[:,2,None] * x[None,:]**2
+
+	spectra = signal + baseline + rng.normal(0, noise * heights.min(), (rows, points))
+
+	peaklist = {'center': centers, 'width': widths, 'start': centers + REGION_WIDTHS * widths, 'end': centers - REGION_WIDTHS * widths}
+	peaklist['area'] = (amplitudes * np.pi * widths[None,:] / abs(axis[1] - axis[0])).T # Sum of points units, peaks x rows
+	return axis, spectra, signal, peaklist
+
+def TruthVolumes(axis, signal, peaklist):
+	# Sum of the pure signal over the same point ranges as GetAxisIndexFromPosition/ExportPeakVolumes
+	idx_start = np.searchsorted(-axis, -peaklist['start'], side = 'right')
+	idx_end = np.searchsorted(-axis, -peaklist['end'], side = 'right')
+	return np.array([signal[:, i0:i1].sum(axis = 1) for i0, i1 in zip(idx_start, idx_end)])
+
+def WritePseudo2D(path, spectra):
+	rows, points = spectra.shape
+	with open(path, 'w') as f:
+		f.write("# File created = synthetic data, GenerateSpectra.py\n")
+		f.write(f"# F2LEFT = {LEFT} ppm. F2RIGHT = {RIGHT} ppm.\n")
+		f.write("#\n")
+		f.write(f"# NROWS = {rows} ( = number of rows)\n")
+		f.write(f"# NCOLS = {points} ( = number of points)\n")
+		f.write("#\n")
+		for rowid in range(rows):
+			f.write(f"# row = {rowid}\n")
+			np.savetxt(f, spectra[rowid], fmt = '%.8g')
+
+def WriteFolder(path, spectra):
+	os.makedirs(path, exist_ok = True)
+	rows, points = spectra.shape
+	for rowid in range(rows):
+		with open(os.path.join(path, f"{rowid + 1}.txt"), 'w') as f:
+			f.write("# File created = synthetic data, GenerateSpectra.py\n")
+			f.write("# Spectral Region:\n")
+			f.write(f"# LEFT = {LEFT} ppm. RIGHT = {RIGHT} ppm.\n")
+			f.write("#\n")
+			f.write(f"# SIZE = {points} ( = number of points)\n")
+			f.write("#\n")
+			np.savetxt(f, spectra[rowid], fmt = '%.8g')
+
+def WriteTruth(path, peaklist, volumes, rowids, title = "Ground truth peak volumes (sum of points of the peak signal)"):
+	with open(path, 'w') as f:
+		f.write(title + "\n")
+		for i in range(len(peaklist['center'])):
+			f.write(f"Peak #{i}, start = {peaklist['start'][i]}ppm, end = {peaklist['end'][i]}ppm\n")
+		f.write("\n")
+		f.write("peak " + " ".join([str(rowid) for rowid in rowids]) + "\n")
+		for i in range(len(volumes)):
+			f.write(str(i) + " " + " ".join([str(v) for v in volumes[i]]) + "\n")
+
+def ReadPeakVolumes(path):
+	# Reads <name>_truth.txt or the <name>_peaks.txt written by ExportPeakVolumes (same layout)
+	# Returns peak regions [start, end, start, end, ...] and volumes (peaks x rows)
+	regions = []
+	volumes = []
+	with open(path) as f:
+		for line in f:
+			if line.startswith('Peak #'):
+				dat = line.replace('ppm', '').replace(',', '').split()
+				regions.extend([float(dat[4]), float(dat[7])])
+			elif len(line.split()) > 1 and line.split()[0].isdigit():
+				volumes.append([float(v) for v in line.split()[1:]])
+	return regions, np.array(volumes)
+
+def Generate(name, rows = 16, points = 16384, peaks = 4, noise = 0.01, curvature = 0.2, seed = 0, folder = False):
+	# Writes the data set and truth file, returns the path of the data and of the truth file
+	axis, spectra, signal, peaklist = GenerateSpectra(rows, points, peaks, noise, curvature, seed)
+	volumes = TruthVolumes(axis, signal, peaklist)
+
+	if folder:
+		path = name
+		WriteFolder(path, spectra)
+		rowids = range(1, rows + 1)
+	else:
+		path = name + ".txt"
+		WritePseudo2D(path, spectra)
+		rowids = range(rows)
+
+	truth = name + "_truth.txt"
+	WriteTruth(truth, peaklist, volumes, rowids)
+	WriteTruth(name + "_areas.txt", peaklist, peaklist['area'], rowids, "Ground truth peak areas (sum of points of the full lines)")
+
+	return path, truth
+
+def Main():
+	args = sys.argv
+
+	if len(args) < 2 or '-help' in args or '-h' in args:
+		print(__doc__)
+		return
+
+	options = {'rows': 16, 'points': 16384, 'peaks': 4, 'noise': 0.01, 'curvature': 0.2, 'seed': 0}
+	for option in options:
+		if '-' + option in args:
+			idx = args.index('-' + option)
+			options[option] = type(options[option])(args[idx + 1])
+
+	path, truth = Generate(args[1], folder = '-folder' in args, **options)
+	print(f"Data:  {path}")
+	print(f"Truth: {truth}")
+
+if __name__ == '__main__':
+	Main()
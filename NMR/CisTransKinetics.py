@@ -0,0 +1,267 @@
+"""
+Cis/Trans Isomerization Kinetics Fitting for NMR Time Series
+
+This script fits reversible first-order cis <-> trans isomerization kinetics to the integral time series in
+NMR/TimeSeries. Raw integrals are converted to concentrations using the calibration factors given in
+TimeSeries/Readme.md, with the calibration uncertainty propagated to the fitted amplitudes by the bootstrap.
+
+Model:
+	d[cis]/dt = -k_ct [cis] + k_tc [trans], with [cis] + [trans] constant after mixing
+	cis(t)   = cis_eq + D exp(-(k_ct + k_tc) t)
+	trans(t) = trans_eq - D exp(-(k_ct + k_tc) t)
+	K = k_ct / k_tc = trans_eq / cis_eq
+
+Cis and trans traces are fitted together with a Levenberg-Marquardt solver that works on a batch of data sets at
+once. Bootstrap errors are obtained by resampling residuals (and drawing one calibration factor shared by cis and
+trans) for all resamples at once and fitting the whole batch in one call. Data sets (variants and replicates) are fitted in parallel.
+
+Rows with time 0 are the pre-mixing reference spectra and are not part of the fit.
+
+Usage:
+python3 CisTransKinetics.py <dataset names (default all)> <options>
+Options:
+-bootstrap X :	number of bootstrap resamples [default 1000]
+-workers X   :	number of parallel processes [default number of data sets]
+-out X       :	write results to file X
+-list        :	list available data sets
+
+Author: Frederik Theisen, 2024
+"""
+
+import sys
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+TIMESERIES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'TimeSeries')
+
+# Integral columns and calibration factors from TimeSeries/Readme.md, factor = (value, error) in integral per µM
+DATASETS = {
+	'WT/TS1': {'file': 'WT/TS1_AllIntegrals.txt', 'cis': 'Cis_narrow', 'trans': 'Trans_narrow',
+		'factor': {'cis': (0.006498, 0), 'trans': (0.008528, 0)}},
+	'WT/TS2': {'file': 'WT/TS2_AllIntegrals.txt', 'cis': 'Cis_narrow', 'trans': 'Trans_narrow',
+		'factor': {'cis': (0.006498, 0), 'trans': (0.008528, 0)}},
+	'W392Y/TS1': {'file': 'W392Y/TS1_AllIntegrals.txt', 'cis': 'Cis', 'trans': 'Trans',
+		'factor': {'cis': (31950, 170), 'trans': (31950, 170)}},
+	'W392Y/TS2': {'file': 'W392Y/TS2_AllIntegrals.txt', 'cis': 'Cis', 'trans': 'Trans',
+		'factor': {'cis': (34426, 201), 'trans': (34426, 201)}},
+	'pT391pS': {'file': 'pT391pS/AllIntegrals.txt', 'cis': 'Cis', 'trans': 'Trans',
+		'factor': {'cis': (12947, 143), 'trans': (12947, 143)}},
+}
+
+PARAMETERS = ['cis_eq', 'trans_eq', 'D', 'k_ex']
+DERIVED = ['k_ct', 'k_tc', 'K']
+BOOTSTRAP = 1000
+MAX_ITERATIONS = 200
+
+def ReadIntegrals(path):
+	# Tab separated table, first column is time. Header of the time column may be empty.
+	with open(path) as f:
+		header = f.readline().rstrip('\n').split('\t')
+		values = np.loadtxt(f, ndmin = 2)
+
+	table = {'Time': values[:,0]}
+	for i in range(1, len(header)):
+		table[header[i].strip()] = values[:,i]
+
+	return table
+
+def LoadDataset(name):
+	# Returns time, cis and trans concentrations (µM)
+	dataset = DATASETS[name]
+	table = ReadIntegrals(os.path.join(TIMESERIES_PATH, dataset['file']))
+
+	mixed = table['Time'] > 0 # Time 0 rows are pre-mixing references
+	data = {'name': name, 'time': table['Time'][mixed]}
+
+	for state in ['cis', 'trans']:
+		factor, _ = dataset['factor'][state]
+		data[state] = table[dataset[state]][mixed] / factor
+
+	return data
+
+def Model(p, t):
+	# p is (batch x 4): cis_eq, trans_eq, D, k_ex. Returns cis, trans as (batch x points)
+	decay = p[:,2,None] * np.exp(-p[:,3,None] * t[None,:])
+	return p[:,0,None] + decay, p[:,1,None] - decay
+
+def Residuals(p, t, cis, trans):
+	model_cis, model_trans = Model(p, t)
+	return np.concatenate([cis - model_cis, trans - model_trans], axis = 1)
+
+def Jacobian(p, t):
+	# Derivatives of the model (cis then trans points) with respect to the parameters, (batch x 2n x 4)
+	e = np.exp(-p[:,3,None] * t[None,:])
+	n = len(t)
+	J = np.zeros((p.shape[0], 2*n, 4))
+	J[:,:n,0] = 1
+	J[:,n:,1] = 1
+	J[:,:n,2] = e
+	J[:,n:,2] = -e
+	J[:,:n,3] = -p[:,2,None] * t[None,:] * e
+	J[:,n:,3] = p[:,2,None] * t[None,:] * e
+	return J
+
+def InitialGuess(t, cis, trans):
+	# For a grid of exchange rates the model is linear, take the best linear solution for each batch entry
+	rates = np.logspace(np.log10(0.1 / t.max()), np.log10(10 / t.min()), 60)
+	n = len(t)
+	best = np.zeros((cis.shape[0], 4))
+	bestcost = np.full(cis.shape[0], np.inf)
+	y = np.concatenate([cis, trans], axis = 1).T
+
+	for rate in rates:
+		e = np.exp(-rate * t)
+		A = np.zeros((2*n, 3))
+		A[:n,0] = 1
+		A[n:,1] = 1
+		A[:n,2] = e
+		A[n:,2] = -e
+		coef, _, _, _ = np.linalg.lstsq(A, y, rcond = None)
+		cost = np.sum((y - A @ coef)**2, axis = 0)
+		better = cost < bestcost
+		best[better,0:3] = coef.T[better]
+		best[better,3] = rate
+		bestcost[better] = cost[better]
+
+	return best
+
+def FitBatch(t, cis, trans, p0 = None):
+	# Levenberg-Marquardt on all batch entries at once, cis and trans are (batch x points)
+	p = InitialGuess(t, cis, trans) if p0 is None else p0.copy()
+	damping = np.full(p.shape[0], 1e-3)
+	cost = np.sum(Residuals(p, t, cis, trans)**2, axis = 1)
+
+	for iteration in range(MAX_ITERATIONS):
+		r = Residuals(p, t, cis, trans)
+		J = Jacobian(p, t)
+		JTJ = np.einsum('bni,bnj->bij', J, J)
+		JTr = np.einsum('bni,bn->bi', J, r)
+		diagonal = np.einsum('bii->bi', JTJ)
+		A = JTJ + damping[:,None,None] * diagonal[:,:,None] * np.eye(4)[None,:,:]
+		step = np.linalg.solve(A + 1e-12 * np.eye(4)[None,:,:], JTr[:,:,None])[:,:,0]
+
+		trial = p + step
+		trial[:,3] = np.abs(trial[:,3])
+		trialcost = np.sum(Residuals(trial, t, cis, trans)**2, axis = 1)
+
+		accept = trialcost < cost
+		p[accept] = trial[accept]
+		converged = np.abs(cost - trialcost) <= 1e-10 * cost
+		cost[accept] = trialcost[accept]
+		damping = np.where(accept, damping / 3, damping * 4)
+
+		if np.all(converged | (damping > 1e10)): break
+
+	return p, cost
+
+def Derived(p):
+	# k_ct, k_tc and K from the fitted parameters
+	K = p[:,1] / p[:,0]
+	k_ct = p[:,3] * K / (1 + K)
+	k_tc = p[:,3] / (1 + K)
+	return np.stack([k_ct, k_tc, K], axis = 1)
+
+def Bootstrap(data, p, resamples, seed = None):
+	# Resample residuals and calibration factors for all resamples at once and fit them as one batch
+	rng = np.random.default_rng(seed)
+	t = data['time']
+	n = len(t)
+
+	model_cis, model_trans = Model(p, t)
+	residuals = Residuals(p, t, data['cis'][None,:], data['trans'][None,:])[0]
+
+	idx = rng.integers(0, 2*n, size = (resamples, 2*n))
+	sample = np.concatenate([model_cis, model_trans], axis = 1) + residuals[idx]
+
+	# One calibration factor per dataset, drawn once per resample and applied to both cis and trans, so K = cis/trans
+	# is not affected by it. The deviation is drawn in units of the error, so states with their own factor values
+	# are scaled consistently
+	dataset = DATASETS[data['name']]
+	deviation = rng.normal(0, 1, size = (resamples, 1))
+	for j, state in enumerate(['cis', 'trans']):
+		factor, error = dataset['factor'][state]
+		sample[:, j*n:(j+1)*n] *= factor / (factor + deviation * error)
+
+	p_boot, _ = FitBatch(t, sample[:,:n], sample[:,n:], np.repeat(p, resamples, axis = 0))
+	return p_boot
+
+def FitDataset(name, resamples = BOOTSTRAP):
+	data = LoadDataset(name)
+	t = data['time']
+
+	p, cost = FitBatch(t, data['cis'][None,:], data['trans'][None,:])
+	result = {'name': name, 'points': len(t), 'rmsd': float(np.sqrt(cost[0] / (2*len(t))))}
+
+	values = np.concatenate([p, Derived(p)], axis = 1)[0]
+	errors = np.full(len(values), np.nan)
+
+	if resamples > 0:
+		p_boot = Bootstrap(data, p, resamples)
+		boot = np.concatenate([p_boot, Derived(p_boot)], axis = 1)
+		boot = boot[np.all(np.isfinite(boot), axis = 1)]
+		errors = np.std(boot, axis = 0)
+
+	for i, parameter in enumerate(PARAMETERS + DERIVED):
+		result[parameter] = (float(values[i]), float(errors[i]))
+
+	return result
+
+def FitDatasets(names, resamples = BOOTSTRAP, workers = None):
+	# Variants and replicates are independent, fit them in parallel
+	if workers is None: workers = len(names)
+	if workers <= 1: return [FitDataset(name, resamples) for name in names]
+
+	with ProcessPoolExecutor(max_workers = workers) as executor:
+		return list(executor.map(FitDataset, names, [resamples] * len(names)))
+
+def FormatResult(result):
+	lines = [f"{result['name']} ({result['points']} points, RMSD = {result['rmsd']:.3f} µM)"]
+	for parameter in PARAMETERS + DERIVED:
+		value, error = result[parameter]
+		lines.append(f"	{parameter:<9}= {value:.6g} ± {error:.2g}")
+	return '\n'.join(lines)
+
+def Main():
+	args = sys.argv
+
+	if '-help' in args or '-h' in args:
+		print(__doc__)
+		return
+
+	if '-list' in args:
+		for name in DATASETS: print(name)
+		return
+
+	resamples = BOOTSTRAP
+	workers = None
+	out = None
+
+	if '-bootstrap' in args:
+		idx = args.index('-bootstrap')
+		resamples = int(args[idx + 1])
+
+	if '-workers' in args:
+		idx = args.index('-workers')
+		workers = int(args[idx + 1])
+
+	if '-out' in args:
+		idx = args.index('-out')
+		out = args[idx + 1]
+
+	names = [arg for arg in args[1:] if arg in DATASETS]
+	if len(names) == 0: names = list(DATASETS.keys())
+
+	print(f"FITTING {len(names)} DATA SETS, {resamples} BOOTSTRAP RESAMPLES...")
+	results = FitDatasets(names, resamples, workers)
+
+	report = '\n\n'.join([FormatResult(result) for result in results])
+	print(report)
+
+	if out is not None:
+		with open(out, 'w') as f:
+			f.write("Units: concentrations µM, rates 1/s (time column of the integral tables)\n\n")
+			f.write(report + '\n')
+
+if __name__ == '__main__':
+	Main()